@@ -0,0 +1,123 @@
+"""
+Read-only triple store with interned terms and numpy columns, for large databases
+"""
+from array import array
+import numpy as np
+
+class CompactStore(object):
+    '''
+    Same lookups as TripleStore (get, subject_ids, object_ids, relation_ids, pair_ids)
+    with a fraction of its memory:
+    - every distinct term (subject, relation or object) is stored once in terms,
+      triples refer to it by its index (term_ids maps a term back to its index)
+    - entry i (a subject, object pair and its relations) is subjects[i], objects[i]
+      and relations[offsets[i]:offsets[i + 1]] (CSR layout), all int32 arrays
+    Lookups are vectorised masks over the columns, so they need no per-term index.
+    Entries keep the order of the json file, like TripleStore's triple ids.
+    It cannot be modified: merges and saves go through TripleStore.
+    '''
+    def __init__(self, terms, subjects, objects, offsets, relations):
+        self.terms = terms
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.subjects = subjects
+        self.objects = objects
+        self.offsets = offsets
+        self.relations = relations
+
+    def __len__(self):
+        return len(self.subjects)
+
+    @classmethod
+    def from_entries(cls, entries):
+        """
+        Build the store from (subject, relations list, object) entries
+        """
+        term_ids = {}
+        # 4 bytes per item while building too, then handed to numpy without a copy
+        subjects, objects, relations = array('i'), array('i'), array('i')
+        offsets = array('i', [0])
+        for subj, rels_ls, obj in entries:
+            subjects.append(term_ids.setdefault(subj, len(term_ids)))
+            objects.append(term_ids.setdefault(obj, len(term_ids)))
+            for rel in rels_ls:
+                relations.append(term_ids.setdefault(rel, len(term_ids)))
+            offsets.append(len(relations))
+        return cls(list(term_ids), *(np.frombuffer(column, dtype=np.int32)
+            for column in (subjects, objects, offsets, relations)))
+
+    @classmethod
+    def from_data(cls, data, subtopic):
+        """
+        Build the store from the loaded json database (same format as data.json)
+        """
+        return cls.from_entries((triple_dict['subject'], triple_dict['relations'], triple_dict['object'])
+            for triple_dict in data.get(subtopic, {}).values())
+
+    @classmethod
+    def from_triples(cls, triples_ls):
+        """
+        Build the store from a list of (subject, relation, object) tuples, merging
+        the triples sharing the same subject and object as TripleStore.from_triples does
+        """
+        pairs = {}
+        for subj, rel, obj in triples_ls:
+            # relations as dict keys: ordered and without duplicates
+            pairs.setdefault((subj, obj), {})[rel] = None
+        return cls.from_entries((subj, list(rels), obj) for (subj, obj), rels in pairs.items())
+
+    def to_data(self, subtopic):
+        """
+        Return the store in the json database format, with entries named "triple<N>"
+        """
+        return {subtopic: {'triple' + str(triple_id): dict(zip(('subject', 'relations', 'object'),
+            self.get(triple_id))) for triple_id in range(len(self))}}
+
+    def nbytes(self):
+        """
+        Memory used by the columns (not counting the terms)
+        """
+        return self.subjects.nbytes + self.objects.nbytes + self.offsets.nbytes + self.relations.nbytes
+
+    def term_id(self, term):
+        """
+        Index of term in terms, None if it is not in the store
+        """
+        return self.term_ids.get(term)
+
+    def get(self, triple_id):
+        terms = self.terms
+        rels_ls = [terms[rel] for rel in self.relations[self.offsets[triple_id]:self.offsets[triple_id + 1]].tolist()]
+        return (terms[self.subjects[triple_id]], rels_ls, terms[self.objects[triple_id]])
+
+    def subject_ids(self, subj):
+        term_id = self.term_id(subj)
+        if term_id is None:
+            return []
+        return np.flatnonzero(self.subjects == term_id).tolist()
+
+    def object_ids(self, obj):
+        term_id = self.term_id(obj)
+        if term_id is None:
+            return []
+        return np.flatnonzero(self.objects == term_id).tolist()
+
+    def relation_ids(self, rel):
+        term_id = self.term_id(rel)
+        if term_id is None:
+            return []
+        # positions in relations -> ids of the entries they belong to
+        positions = np.flatnonzero(self.relations == term_id)
+        return np.unique(np.searchsorted(self.offsets, positions, side='right') - 1).tolist()
+
+    def pair_ids(self, ent1, ent2):
+        """
+        Return the sorted ids of triples linking ent1 and ent2 in either direction
+        """
+        id1 = self.term_id(ent1)
+        id2 = self.term_id(ent2)
+        if id1 is None or id2 is None:
+            return []
+        mask = (self.subjects == id1) & (self.objects == id2)
+        if id1 != id2:
+            mask |= (self.subjects == id2) & (self.objects == id1)
+        return np.flatnonzero(mask).tolist()
@@ -4,206 +4,240 @@ Build and Draw KG based on both users' Document and our Database
 import json
 import os
 import networkx as nx
-import matplotlib.pyplot as plt
+import matplotlib
+# no GUI backend and no pyplot global state: figures are only rendered to html,
+# possibly from several request threads at once
+matplotlib.use('Agg')
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import mpld3
-mpld3.enable_notebook
-from copy import deepcopy
+from .TripleStore import TripleStore, load_store, file_version
+from Web.instrumentation import stage
 
 class KnowledgeGraph(object):
-    def __init__(self, db_file, subtopic, triples_ls):
+    def __init__(self, db_file, subtopic, triples_ls, private_db=False, backend='json'):
         """
         INPUT: db_file is the json file that store our whole database
                triples_ls is the list of triple parsed from users' document
                subtopic is the subtopic for the Database (currently defualt for Finance)
+               private_db (debugging only) write the users' triples to the "private_db"
+                json file and read them back instead of indexing them in memory
+               backend is where our database is: 'json' (db_file) or 'sqlite'
+                (the Triple table of the Django database, db_file is then unused)
         """
         self.db_file = db_file
         self.subtopic = subtopic
         self.triples_ls = triples_ls
+        self.private_db = private_db
+        self.backend = backend
         # a html string so we can easily reload the webpage and change the html paragraph for new KG
         self.main_html_str = ""
         
     def KGsave(self, subtopic):
         """
         Add triples_ls (from users' documents) into our DB if allowed
+        Return a MergeReport with the number of new, merged and duplicate triples
         """
-        self.json_store(self.triples_ls, subtopic, self.db_file)
-        os.remove("private_db")
+        if self.backend == 'sqlite':
+            # only the new triples are written
+            from .TripleDB import save_triples
+            report = save_triples(self.triples_ls, subtopic)
+        else:
+            report = self.json_store(self.triples_ls, subtopic, self.db_file)
+        self.KGdelete(subtopic)
+        return report
+
+    def db_version(self):
+        """
+        Version stamp of our DB, changes whenever it is rewritten (e.g. by KGsave)
+        """
+        if self.backend == 'sqlite':
+            from .TripleDB import db_version
+            return db_version(self.subtopic)
+        return file_version(self.db_file)
+
+    def main_store(self):
+        """
+        Our DB's TripleStore for find_triples (loaded and indexed once per process)
+        """
+        if self.backend == 'sqlite':
+            from .TripleDB import load_db_store
+            return load_db_store(self.subtopic)
+        return load_store(self.db_file, self.subtopic)
 
     def KGdelete(self, subtopic):
         """
-        Delete the temporary json file from the user used to draw KG
+        Delete the temporary json file from the user used to draw KG (private_db mode only)
         """
-        os.remove("private_db")
+        if self.private_db and os.path.exists("private_db"):
+            os.remove("private_db")
 
-    def KGdraw(self, ents_set, rels_set):
+    def doc_store(self):
         """
-        From the ents_set and rels_set parsed from the question, 
-        draw KG based on 1. users' doc and 2. our db
+        Index the triples from the users' document for find_triples
+        """
+        if self.private_db:
+            # start from an empty file so triples from a previous request never leak in
+            self.KGdelete(self.subtopic)
+            self.json_store(self.triples_ls, self.subtopic, "private_db")
+            with open("private_db") as f:
+                priv_data = json.load(f)
+            return TripleStore.from_data(priv_data, self.subtopic)
+        return TripleStore.from_triples(self.triples_ls)
+
+    def KGpanels(self, ents_set, rels_set):
+        """
+        From the ents_set and rels_set parsed from the question, find the triples of
+        the 6 sections of our KG based on 1. users' doc and 2. our db
+        Return a list of (subplot_pos, title, triples)
         """
         # Find sub list of triples_ls from users doc based on ents_set and rels_set
         ents_ls = list(ents_set)
-        plt.rcParams['figure.figsize'] = [8,12]
-        plt.rcParams['figure.dpi'] = 100
-        fig = plt.figure()
         # From the document
-        self.json_store(self.triples_ls, self.subtopic, "private_db")
-        with open("private_db") as f:
-            priv_data = json.load(f)
-        t1, t2, t3, t4 = self.find_triples(priv_data, self.subtopic, ents_ls, rels_set)
-        # Sub_list1: perfect match to query
-        # plt.subplot(3, 2, 1)
-        title1 = "Perfect Match from your Doc"
-        self.printGraph(t1, fig, 321, title1, self.main_html_str)
-        # Sub_list2: different relations from query
-        #plt.subplot(3, 2, 2)
-        title2 = "Both similar Entities from your Doc"
-        self.printGraph(t2, fig, 322, title2, self.main_html_str)
-        # Sub_list3: only ent1 match
-        #plt.subplot(3, 2, 3)
-        title3 = f"Entity '{ents_ls[0]}' from your doc"
-        self.printGraph(t3, fig, 323, title3, self.main_html_str)
-        # Sub_list4: only ent2 match
-        #plt.subplot(3, 2, 4)
-        title4 = f"Entity '{ents_ls[-1]}' from your doc"
-        self.printGraph(t4, fig, 324, title4, self.main_html_str)
-
+        priv_store = self.doc_store()
+        with stage('kg.find_triples', store_triples=len(priv_store)) as timing:
+            t1, t2, t3, t4 = self.find_triples(priv_store, ents_ls, rels_set)
+            timing.add(matches=len(t1) + len(t2) + len(t3) + len(t4))
         # From database
-        with open(self.db_file) as f:
-            main_data = json.load(f)
+        main_store = self.main_store()
+        with stage('kg.find_triples', store_triples=len(main_store)) as timing:
+            t5, t6, t7, t8 = self.find_triples(main_store, ents_ls, rels_set)
+            timing.add(matches=len(t5) + len(t6))
+        self.KGdelete(self.subtopic)
 
-        t5, t6, t7, t8 = self.find_triples(main_data, self.subtopic, ents_ls, rels_set)
+        return [
+            # Sub_list1: perfect match to query
+            (321, "Perfect Match from your Doc", t1),
+            # Sub_list2: different relations from query
+            (322, "Both similar Entities from your Doc", t2),
+            # Sub_list3: only ent1 match
+            (323, f"Entity '{ents_ls[0]}' from your doc", t3),
+            # Sub_list4: only ent2 match
+            (324, f"Entity '{ents_ls[-1]}' from your doc", t4),
+            # Sub_list5: perfect match to query
+            (325, "Perfect Match from our Database", t5),
+            # Sub_list6: different relations from query
+            (326, "Partial Match from our Database", t6),
+        ]
 
-        # Sub_list5: perfect match to query
-        #plt.subplot(3, 2, 5)
-        title5 = "Perfect Match from our Database"
-        self.printGraph(t5, fig, 325, title5, self.main_html_str)
-        # Sub_list6: different relations from query
-        #plt.subplot(3, 2, 6)
-        title6 = "Partial Match from our Database"
-        self.printGraph(t6, fig, 326, title6, self.main_html_str)
+    def KGdraw(self, ents_set, rels_set):
+        """
+        From the ents_set and rels_set parsed from the question, 
+        draw KG based on 1. users' doc and 2. our db
+        """
+        # a figure owned by this call only (not registered with pyplot), disposed of once rendered
+        fig = Figure(figsize=[8,12], dpi=100)
+        FigureCanvasAgg(fig)
+        try:
+            for subplot_pos, title, triples_ls in self.KGpanels(ents_set, rels_set):
+                with stage('kg.printGraph', triples=len(triples_ls)):
+                    self.printGraph(triples_ls, fig, subplot_pos, title, self.main_html_str)
+            # An html string to easily update our ResultsPage, rendered once with all 6 subplots
+            with stage('kg.fig_to_html'):
+                self.main_html_str = mpld3.fig_to_html(fig)
+        finally:
+            fig.clear()
 
-        # plt.axis('off')
-        # plt.show()
-        self.KGdelete(self.subtopic)
+    def KGgraph(self, ents_set, rels_set):
+        """
+        Same 6 sections as KGdraw but without any server-side plotting:
+        return a json-ready list of {'title', 'nodes', 'edges'} drawn by the browser (kgrender.js)
+        """
+        self.graph_panels = []
+        for _, title, triples_ls in self.KGpanels(ents_set, rels_set):
+            with stage('kg.graph_data', triples=len(triples_ls)) as timing:
+                nodes, edges = self.graph_data(triples_ls)
+                timing.add(nodes=len(nodes), edges=len(edges))
+            self.graph_panels.append({'title': title, 'nodes': nodes, 'edges': edges})
+        return self.graph_panels
 
+    def graph_data(self, triples_ls, cap=3):
+        """
+        Nodes and edges of the KG drawn for triples_ls, limited to cap relations.
+        nodes is a list of [name, 'ent' or 'rel'], edges a list of [source, target] node indexes
+        """
+        nodes = []; index = {}; edges = []; edge_set = set()
+        verb_cnt = 0
+        for subj, verb, obj in triples_ls:
+            if verb_cnt == cap:
+                break
+            for name, kind in ((subj, 'ent'), (verb, 'rel'), (obj, 'ent')):
+                if name not in index:
+                    index[name] = len(nodes)
+                    nodes.append([name, kind])
+                    if kind == 'rel':
+                        verb_cnt += 1
+            for edge in ((index[subj], index[verb]), (index[verb], index[obj])):
+                if edge not in edge_set:
+                    edge_set.add(edge)
+                    edges.append(list(edge))
+        return nodes, edges
 
     def json_store(self, triples_ls, subtopic, filename):
         """
         INPUT: triples_ls is the list of triple parsed from users' document
                subtopic is the name of the database to be queried (currently only support Finance)
-               db_file is the json file that store our whole database
-        OUTPUT: continue to write onto existing DB db_file
+               filename is the json file to merge the triples into (e.g. our whole database)
+        OUTPUT: continue to write onto existing DB filename,
+                return a MergeReport with the number of new, merged and duplicate triples
         """
         # open json file, if no then create 1.
         try:
-            with open(db_file) as f:
+            with open(filename) as f:
                 data = json.load(f)
-        except:
+        except (OSError, ValueError):
             data = {}
-        # storing fist key according to the wiki name
-        data[subtopic] = {}
-
-        # iterate through triple to find instance where same entities share multiple relations
-        # find counter value (number of triples_ls already stored):
-        if not data[subtopic]:
-            cnt = 0
-        else:
-            cnt = len(data[subtopic])
-
-        for triple in triples_ls:
-            obj_flag = False; subj_flag = False; verb_flag = False
-
-            # if the dictionary is still empty, just add
-            if not data[subtopic]:
-                name = 'triple' + str(cnt)
-                data[subtopic].update({name : {
-                                                'subject': triple[0],
-                                                'relations': [triple[1]],
-                                                'object': triple[2]
-                                            }})
-                cnt += 1
-                continue
-            else:
-                for name, triple_dict in data[subtopic].items():
-                    # iterate throught triple_dict of subject, relations, object
-                    for k, v in triple_dict.items():
-                        if k == 'subject' and triple[0] == v:
-                            subj_flag = True
-                        if k == 'object' and triple[2] == v:
-                            obj_flag = True
-                        if k == 'relations' and triple[1] in v:
-                            verb_flag = True
-                    if subj_flag == True and obj_flag == True:
-                        curr_name = name
-                        break
-                    else:
-                        subj_flag = False
-                        obj_flag = False
 
-            if subj_flag == True and obj_flag == True and verb_flag == False:
-                data[subtopic][curr_name]['relations'].append(triple[1])
-            elif subj_flag == True and obj_flag == True and verb_flag == True:
-                continue
-            # else no duplication at all
-            else:
-                name = 'triple' + str(cnt)
-                data[subtopic].update({name : {
-                                                'subject': triple[0],
-                                                'relations': [triple[1]],
-                                                'object': triple[2]
-                                            }})
-                cnt += 1
+        # triples sharing the same subject and object are merged into a single entry
+        # with a list of relations, keyed on (subject, object) so each triple is O(1)
+        store = TripleStore.from_data(data, subtopic)
+        report = store.merge(triples_ls)
+        data.update(store.to_data(subtopic))
         with open(filename, 'w+') as outfile:
             json.dump(data, outfile)
+        return report
 
-    def find_triples(self, data, subtopic, ents_ls, rel_set):
+    def find_triples(self, store, ents_ls, rel_set):
         """
         Find matching triples from the users' Questions vs their Document or our Database
         There will be 4 cases as shown below.
-        INPUT: data is the database to compare, it can be our DB 
+        INPUT: store is the TripleStore (or CompactStore) to compare, it can be our DB
                 or the temporary DB we create from the users' Doc
-               subtopic is the chosen DB to compare with (defualt as "Finance")
                ents_ls is the list of entities from the users' Questions
                rels_set is the set of relations from the users' Questions
         """
         t1,t2,t3,t4 = [],[],[],[]
-        for triple in data[subtopic]:
-            subj = data[subtopic][triple]['subject']
-            obj = data[subtopic][triple]['object']
-            rels_ls = data[subtopic][triple]['relations']
+        ent1 = ents_ls[0]; ent2 = ents_ls[-1]
+        # triples with both entities (either direction) go to t1 or t2, never to t3/t4
+        pair_ids = store.pair_ids(ent1, ent2)
+        for triple_id in pair_ids:
+            subj, rels_ls, obj = store.get(triple_id)
             # scenario 1 (t1) : a list of perfect match: ent1 and ent2 in ents_ls AND rel in rel_set
-            if ((subj == ents_ls[0] and obj == ents_ls[-1]) or 
-                (obj == ents_ls[0] and subj == ents_ls[-1])) and \
-                any(item in rels_ls for item in list(rel_set)):
-                    for triple_rel in rels_ls:
-                        for set_rel in rel_set:
-                            if set_rel in triple_rel:
-                                new_triple = deepcopy(data[subtopic][triple])
-                                new_triple["relations"] = triple_rel
-                                triple_set = (new_triple['subject'], new_triple["relations"], new_triple["object"])
-                                t1.append(triple_set)
-            # scenario 2 (t2) : 2 entities match, different relations: ent1 and ent2 in ents_ls AND rel not in rel_set
-            elif ((subj == ents_ls[0] and obj == ents_ls[-1]) or 
-                (obj == ents_ls[0] and subj == ents_ls[-1])):
+            if any(item in rels_ls for item in rel_set):
                 for triple_rel in rels_ls:
-                    new_triple = deepcopy(data[subtopic][triple])
-                    new_triple["relations"] = triple_rel
-                    triple_set = (new_triple['subject'], new_triple["relations"], new_triple["object"])
-                    t2.append(triple_set)
-            # scenario 3 (t3) : only ent1 can be found as subject
-            elif subj == ents_ls[0]:
+                    for set_rel in rel_set:
+                        if set_rel in triple_rel:
+                            t1.append((subj, triple_rel, obj))
+            # scenario 2 (t2) : 2 entities match, different relations: ent1 and ent2 in ents_ls AND rel not in rel_set
+            else:
                 for triple_rel in rels_ls:
-                    new_triple = deepcopy(data[subtopic][triple])
-                    new_triple["relations"] = triple_rel
-                    triple_set = (new_triple['subject'], new_triple["relations"], new_triple["object"])
-                    t3.append(triple_set)
-            # scenario 4 (t4) : only ent2 can be found as subject
-            elif subj == ents_ls[-1]:
+                    t2.append((subj, triple_rel, obj))
+        pair_ids = set(pair_ids)
+        # scenario 3 (t3) : only ent1 can be found as subject
+        for triple_id in store.subject_ids(ent1):
+            if triple_id in pair_ids:
+                continue
+            subj, rels_ls, obj = store.get(triple_id)
+            for triple_rel in rels_ls:
+                t3.append((subj, triple_rel, obj))
+        # scenario 4 (t4) : only ent2 can be found as subject
+        if ent2 != ent1:
+            for triple_id in store.subject_ids(ent2):
+                if triple_id in pair_ids:
+                    continue
+                subj, rels_ls, obj = store.get(triple_id)
                 for triple_rel in rels_ls:
-                    new_triple = deepcopy(data[subtopic][triple])
-                    new_triple["relations"] = triple_rel
-                    triple_set = (new_triple['subject'], new_triple["relations"], new_triple["object"])
-                    t4.append(triple_set)
+                    t4.append((subj, triple_rel, obj))
         return t1,t2,t3,t4
 
     def printGraph(self, triples_ls, fig, subplot_pos, title, _main_html_str):
@@ -212,57 +246,37 @@ class KnowledgeGraph(object):
         '''
         G = nx.MultiDiGraph()
         color_map = []
-        cap = 3
 
         # If not match found, display "No Mathc Found"
         if not triples_ls:
             pos = nx.circular_layout(G)
             ax = fig.add_subplot(subplot_pos)
             ax.set_title(title, fontsize=20)
-            plt.text(0.5, 0.5, 'No Match Found', fontsize = 12, color='red',
+            ax.text(0.5, 0.5, 'No Match Found', fontsize = 12, color='red',
                 horizontalalignment='center', verticalalignment='center', transform=ax.transAxes)
-            plt.axis('off')
+            ax.axis('off')
         # draw node and edges for KG
         else:
-            verb_cnt = 0;
-            for triple in triples_ls:
-                if verb_cnt == cap:
-                    break
-                subj = triple[0]
-                verb = triple[1]
-                obj = triple[2]
-            
-                if subj not in G:
-                    G.add_node(subj)
-                    color_map.append('blue')
-                if verb not in G and verb_cnt < cap:
-                    G.add_node(verb)
-                    color_map.append('red')
-                    verb_cnt += 1
-                if obj not in G:
-                    G.add_node(obj)
-                    color_map.append('blue')
-
-                G.add_edge(subj, verb)
-                G.add_edge(verb, obj)   
+            nodes, edges = self.graph_data(triples_ls)
+            for name, kind in nodes:
+                G.add_node(name)
+                color_map.append('red' if kind == 'rel' else 'blue')
+            for source, target in edges:
+                G.add_edge(nodes[source][0], nodes[target][0])
             pos = nx.circular_layout(G)
             ax = fig.add_subplot(subplot_pos)
 
-            nx.draw(G, pos, edge_color='black', width=1, linewidths=1,
+            nx.draw(G, pos, ax=ax, edge_color='black', width=1, linewidths=1,
                     node_size=200, node_color=color_map, alpha=0.9,
                     labels={node: node for node in G.nodes()})
             ax.set_title(title, fontsize=20)
-            plt.axis('off')
+            ax.axis('off')
 
         # Resizing
         scale_factor = 1.5
 
-        xmin, xmax = plt.xlim()
-        ymin, ymax = plt.ylim()
-
-        plt.xlim(xmin * scale_factor, xmax * scale_factor)
-        plt.ylim(ymin * scale_factor, ymax * scale_factor)
+        xmin, xmax = ax.get_xlim()
+        ymin, ymax = ax.get_ylim()
 
-        # An html string to easily update our ResultsPage 
-        html_str = mpld3.fig_to_html(fig)
-        self.main_html_str = html_str
\ No newline at end of file
+        ax.set_xlim(xmin * scale_factor, xmax * scale_factor)
+        ax.set_ylim(ymin * scale_factor, ymax * scale_factor)
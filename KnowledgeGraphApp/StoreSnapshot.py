@@ -0,0 +1,147 @@
+"""
+Binary snapshot of a CompactStore, memory-mapped read-only so that opening it costs
+almost nothing and every worker process shares the same page-cached copy.
+Layout (little-endian), each section starting on an 8-byte boundary:
+- header: HEADER struct (magic, format version, counts, version of the source: the json
+  file's TripleStore.file_version or the Triple table's TripleDB.db_version)
+- term_offsets: uint32 x (n_terms + 1), where each term starts in the term blob
+- subjects, objects: int32 x n_entries
+- offsets: int32 x (n_entries + 1), relations: int32 x n_relations (CSR, see CompactStore)
+- term blob: the utf-8 terms, sorted so a term's index is found by bisection
+"""
+import mmap
+import os
+import struct
+import tempfile
+from bisect import bisect_left
+import numpy as np
+from .CompactStore import CompactStore
+
+MAGIC = b"NLPKGSNP"
+FORMAT_VERSION = 1
+# magic, format version, n_terms, n_entries, n_relations, source version (2 integers)
+HEADER = struct.Struct("<8sIIIIqq")
+
+def snapshot_path(db_file, subtopic):
+    """
+    Snapshot of subtopic built from db_file (the json file or the SQLite database), next to it
+    """
+    return f"{db_file}.{subtopic}.kgsnap"
+
+def padding(size):
+    return -size % 8
+
+class SnapshotTerms(object):
+    '''
+    Read-only sequence of the terms of a snapshot, decoded from the mapped blob on access
+    '''
+    def __init__(self, buffer, term_offsets, blob_start):
+        self.buffer = buffer
+        self.term_offsets = term_offsets
+        self.blob_start = blob_start
+
+    def __len__(self):
+        return len(self.term_offsets) - 1
+
+    def __getitem__(self, i):
+        start = self.blob_start + int(self.term_offsets[i])
+        end = self.blob_start + int(self.term_offsets[i + 1])
+        return self.buffer[start:end].decode("utf-8")
+
+class SnapshotStore(CompactStore):
+    '''
+    CompactStore whose columns and terms are read from a memory-mapped snapshot.
+    Terms are looked up by bisection in the sorted term table instead of a dict,
+    so nothing is built when it is opened.
+    '''
+    def __init__(self, terms, subjects, objects, offsets, relations, source_version):
+        self.terms = terms
+        self.subjects = subjects
+        self.objects = objects
+        self.offsets = offsets
+        self.relations = relations
+        self.source_version = source_version
+
+    def term_id(self, term):
+        i = bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return i
+        return None
+
+def write_snapshot(store, path, source_version):
+    """
+    INPUT: store is the CompactStore to save
+           path is the snapshot file to (re)write
+           source_version is the version of what the store was loaded from (see HEADER)
+    OUTPUT: the snapshot is written aside then renamed, so processes that mapped
+            the previous one keep reading it unchanged
+    """
+    # renumber the terms in sorted order
+    order = sorted(range(len(store.terms)), key=store.terms.__getitem__)
+    new_ids = np.empty(len(order), dtype=np.int32)
+    new_ids[order] = np.arange(len(order), dtype=np.int32)
+    encoded = [store.terms[i].encode("utf-8") for i in order]
+    term_offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+    term_offsets[1:] = np.cumsum([len(term) for term in encoded])
+
+    sections = [
+        term_offsets.tobytes(),
+        new_ids[store.subjects].astype("<i4").tobytes(),
+        new_ids[store.objects].astype("<i4").tobytes(),
+        store.offsets.astype("<i4").tobytes(),
+        new_ids[store.relations].astype("<i4").tobytes(),
+        b"".join(encoded),
+    ]
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(encoded), len(store.subjects), len(store.relations),
+        *source_version)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for section in [header] + sections:
+                f.write(section)
+                f.write(b"\0" * padding(len(section)))
+        # readable by the web workers, whoever built it
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+def open_snapshot(path, source_version=None):
+    """
+    Map the snapshot at path and return its SnapshotStore.
+    Return None if there is no (valid) snapshot, or if it was not built from
+    its source at source_version (when given), i.e. it is stale.
+    """
+    try:
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # missing or empty file
+        return None
+    if len(buffer) < HEADER.size:
+        return None
+    magic, format_version, n_terms, n_entries, n_relations, *version = HEADER.unpack_from(buffer)
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+        return None
+    if source_version is not None and tuple(version) != tuple(source_version):
+        return None
+
+    position = HEADER.size + padding(HEADER.size)
+    def column(dtype, count):
+        nonlocal position
+        array = np.frombuffer(buffer, dtype=dtype, count=count, offset=position)
+        position += array.nbytes + padding(array.nbytes)
+        return array
+    try:
+        term_offsets = column("<u4", n_terms + 1)
+        subjects = column("<i4", n_entries)
+        objects = column("<i4", n_entries)
+        offsets = column("<i4", n_entries + 1)
+        relations = column("<i4", n_relations)
+    except ValueError:
+        # truncated file
+        return None
+    terms = SnapshotTerms(buffer, term_offsets, position)
+    return SnapshotStore(terms, subjects, objects, offsets, relations, tuple(version))
@@ -0,0 +1,114 @@
+"""
+Our DB as rows of the Triple model (the Django database) instead of the json file:
+incremental saves, and stores loaded from the table for the KG lookups
+"""
+import json
+import threading
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from .models import Triple, TripleVersion
+from .TripleStore import TripleStore, DUPLICATE, NEW, MERGED, MergeReport
+from .CompactStore import CompactStore
+from .StoreSnapshot import open_snapshot, snapshot_path
+
+# Rows per INSERT, and subjects per "IN (...)" query (SQLite allows 999 parameters)
+BATCH_SIZE = 500
+
+def db_version(subtopic):
+    """
+    Cheap version stamp of the triples of subtopic: its TripleVersion, bumped by every
+    save_triples that adds rows (two integers like TripleStore.file_version, the second is unused)
+    """
+    version = TripleVersion.objects.filter(subtopic=subtopic).values_list('version', flat=True).first()
+    return (version or 0, 0)
+
+def db_snapshot_path(subtopic):
+    """
+    Snapshot of the triples of subtopic (see StoreSnapshot), next to the SQLite database
+    """
+    return snapshot_path(settings.DATABASES['default']['NAME'], subtopic)
+
+def rows(subtopic, model=Triple, subjects=None):
+    """
+    Yield the (subject, relation, object) of subtopic in insertion order,
+    only those of subjects if given
+    """
+    queryset = model.objects.filter(subtopic=subtopic)
+    if subjects is None:
+        yield from queryset.order_by('id').values_list('subject', 'relation', 'object').iterator()
+        return
+    subjects = list(subjects)
+    for i in range(0, len(subjects), BATCH_SIZE):
+        yield from queryset.filter(subject__in=subjects[i:i + BATCH_SIZE]) \
+            .order_by('id').values_list('subject', 'relation', 'object').iterator()
+
+def save_triples(triples_ls, subtopic, model=Triple):
+    """
+    INPUT: triples_ls is a list of (subject, relation, object) tuples
+           subtopic is the name of the database to add them to
+    OUTPUT: insert the triples not stored yet (only reading the rows of their subjects),
+            return a MergeReport with the number of new, merged and duplicate triples
+    Concurrent saves are safe: the unique constraint drops any row inserted twice,
+    the report may then count it as new in both.
+    """
+    triples_ls = list(triples_ls)
+    # the stored triples of the same subjects are enough to tell new, merged and duplicates
+    store = TripleStore.from_triples(rows(subtopic, model, {subj for subj, _, _ in triples_ls}))
+    counts = {NEW: 0, MERGED: 0, DUPLICATE: 0}
+    new_rows = []
+    for subj, rel, obj in triples_ls:
+        outcome = store.add_triple(subj, rel, obj)
+        counts[outcome] += 1
+        if outcome != DUPLICATE:
+            new_rows.append(model(subtopic=subtopic, subject=subj, relation=rel, object=obj))
+    if new_rows:
+        with transaction.atomic():
+            model.objects.bulk_create(new_rows, batch_size=BATCH_SIZE, ignore_conflicts=True)
+            # committed with the rows: a reader never sees new rows under the old version
+            TripleVersion.objects.get_or_create(subtopic=subtopic)
+            TripleVersion.objects.filter(subtopic=subtopic).update(version=F('version') + 1)
+    return MergeReport(counts[NEW], counts[MERGED], counts[DUPLICATE])
+
+def import_json(db_file, subtopics=None, model=Triple):
+    """
+    Save the triples of a json database (same format as data.json) into the table.
+    Return {subtopic: MergeReport}, for every subtopic of the file or only those given.
+    """
+    with open(db_file) as f:
+        data = json.load(f)
+    reports = {}
+    for subtopic in data:
+        if subtopics and subtopic not in subtopics:
+            continue
+        store = TripleStore.from_data(data, subtopic)
+        triples_ls = [(subj, rel, obj) for subj, rels_ls, obj in store.triples for rel in rels_ls]
+        reports[subtopic] = save_triples(triples_ls, subtopic, model)
+    return reports
+
+
+# Stores loaded from the table, shared by every request of this process.
+# Revalidated against db_version so saves from any process are picked up.
+_stores = {}
+_stores_lock = threading.Lock()
+
+def load_db_store(subtopic):
+    """
+    Return the CompactStore for subtopic from the Triple table, loading the rows
+    only the first time (or after triples have been added). A snapshot of that
+    version of the table (see StoreSnapshot) is mapped instead of reading the rows.
+    """
+    version = db_version(subtopic)
+    cached = _stores.get(subtopic)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _stores_lock:
+        cached = _stores.get(subtopic)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        # the snapshot built from this version of the table if there is one, else the rows
+        store = open_snapshot(db_snapshot_path(subtopic), version)
+        if store is None:
+            store = CompactStore.from_triples(rows(subtopic))
+        _stores[subtopic] = (version, store)
+        return store
@@ -0,0 +1,188 @@
+"""
+Process-resident triple store with hash indexes for fast KG lookups
+"""
+import json
+import os
+import threading
+from collections import namedtuple
+from .CompactStore import CompactStore
+from .StoreSnapshot import open_snapshot, snapshot_path
+
+# Outcome of adding one (subject, relation, object) triple to a store
+NEW, MERGED, DUPLICATE = 'new', 'merged', 'duplicate'
+
+MergeReport = namedtuple('MergeReport', ['new', 'merged', 'duplicates'])
+
+class TripleStore(object):
+    '''
+    Holds the triples of one subtopic in memory and indexes them by subject, object,
+    (subject, object) pair and relation.
+    Triple ids follow the order of the triples in the json file, so any lookup
+    returns triples in the same order as a full scan of the file would.
+    '''
+    def __init__(self):
+        # triple id -> (subject, relations list, object)
+        self.triples = []
+        # triple id -> set of its relations (for O(1) duplicate checks) and json key name
+        self.rel_sets = []
+        self.names = []
+        self.name_set = set()
+        self.by_subject = {}
+        self.by_object = {}
+        self.by_pair = {}
+        self.by_relation = {}
+
+    def __len__(self):
+        return len(self.triples)
+
+    @classmethod
+    def from_data(cls, data, subtopic):
+        """
+        Build the store from the loaded json database (same format as data.json)
+        """
+        store = cls()
+        for name, triple_dict in data.get(subtopic, {}).items():
+            store.add(triple_dict['subject'], triple_dict['relations'], triple_dict['object'], name)
+        return store
+
+    @classmethod
+    def from_triples(cls, triples_ls):
+        """
+        Build the store straight from a list of (subject, relation, object) tuples,
+        e.g. the triples parsed from users' document.
+        Triples sharing the same subject and object are merged into one entry.
+        """
+        store = cls()
+        store.merge(triples_ls)
+        return store
+
+    def to_data(self, subtopic):
+        """
+        Return the store in the json database format: {subtopic: {name: triple_dict}}
+        """
+        entries = {}
+        for name, (subj, rels_ls, obj) in zip(self.names, self.triples):
+            entries[name] = {'subject': subj, 'relations': rels_ls, 'object': obj}
+        return {subtopic: entries}
+
+    def merge(self, triples_ls):
+        """
+        Add every (subject, relation, object) tuple of triples_ls in linear time.
+        Return a MergeReport counting the triples that created a new entry, were
+        merged into an existing (subject, object) entry, or were already stored.
+        """
+        counts = {NEW: 0, MERGED: 0, DUPLICATE: 0}
+        for subj, rel, obj in triples_ls:
+            counts[self.add_triple(subj, rel, obj)] += 1
+        return MergeReport(counts[NEW], counts[MERGED], counts[DUPLICATE])
+
+    def add_triple(self, subj, rel, obj):
+        """
+        Add a single (subject, relation, object) triple, merging its relation into
+        the existing entry for (subject, object) if there is one.
+        Return NEW, MERGED or DUPLICATE.
+        """
+        ids = self.by_pair.get((subj, obj))
+        if not ids:
+            self.add(subj, [rel], obj)
+            return NEW
+        triple_id = ids[0]
+        if rel in self.rel_sets[triple_id]:
+            return DUPLICATE
+        self.triples[triple_id][1].append(rel)
+        self.rel_sets[triple_id].add(rel)
+        self.add_relation_index(rel, triple_id)
+        return MERGED
+
+    def add(self, subj, rels_ls, obj, name=None):
+        """
+        Append a new triple entry and index it. Return its triple id.
+        """
+        triple_id = len(self.triples)
+        rels_ls = list(rels_ls)
+        self.triples.append((subj, rels_ls, obj))
+        self.rel_sets.append(set(rels_ls))
+        if name is None:
+            name = self.new_name(triple_id)
+        self.names.append(name)
+        self.name_set.add(name)
+        self.by_subject.setdefault(subj, []).append(triple_id)
+        self.by_object.setdefault(obj, []).append(triple_id)
+        self.by_pair.setdefault((subj, obj), []).append(triple_id)
+        for rel in rels_ls:
+            self.add_relation_index(rel, triple_id)
+        return triple_id
+
+    def new_name(self, triple_id):
+        # "triple<N>" keys as in data.json, skipping any name already taken
+        name = 'triple' + str(triple_id)
+        while name in self.name_set:
+            triple_id += 1
+            name = 'triple' + str(triple_id)
+        return name
+
+    def add_relation_index(self, rel, triple_id):
+        ids = self.by_relation.setdefault(rel, [])
+        if not ids or ids[-1] != triple_id:
+            ids.append(triple_id)
+
+    def get(self, triple_id):
+        return self.triples[triple_id]
+
+    def subject_ids(self, subj):
+        return self.by_subject.get(subj, [])
+
+    def object_ids(self, obj):
+        return self.by_object.get(obj, [])
+
+    def relation_ids(self, rel):
+        return self.by_relation.get(rel, [])
+
+    def pair_ids(self, ent1, ent2):
+        """
+        Return the sorted ids of triples linking ent1 and ent2 in either direction
+        """
+        ids = self.by_pair.get((ent1, ent2), [])
+        if ent1 != ent2:
+            reverse_ids = self.by_pair.get((ent2, ent1), [])
+            if reverse_ids:
+                ids = sorted(ids + reverse_ids)
+        return ids
+
+
+# Stores loaded from json files, shared by every request of this process (read-only,
+# so held as CompactStores). Keyed on (path, subtopic) and revalidated against the file's mtime and size
+# so a KGsave (or any other write to the file) is picked up on the next lookup.
+_stores = {}
+_stores_lock = threading.Lock()
+
+def file_version(db_file):
+    """
+    Return a cheap version stamp of db_file, changing whenever the file is rewritten
+    """
+    stat = os.stat(db_file)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def load_store(db_file, subtopic):
+    """
+    Return the CompactStore for subtopic from db_file, loading the file only the
+    first time (or after it has changed on disk). A snapshot of that version of
+    the file (see StoreSnapshot) is mapped instead of parsing the json.
+    """
+    key = (os.path.abspath(db_file), subtopic)
+    version = file_version(db_file)
+    cached = _stores.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _stores_lock:
+        cached = _stores.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        # the snapshot built from this version of the file if there is one, else the file itself
+        store = open_snapshot(snapshot_path(db_file, subtopic), version)
+        if store is None:
+            with open(db_file) as f:
+                data = json.load(f)
+            store = CompactStore.from_data(data, subtopic)
+        _stores[key] = (version, store)
+        return store
@@ -0,0 +1,57 @@
+"""
+Build the memory-mapped snapshots of our DB, mapped by the workers instead of parsing
+the json or reading the Triple table (see KnowledgeGraphApp.StoreSnapshot)
+Usage: python manage.py build_kg_snapshot [FILE] [--subtopic NAME ...] [--backend json|sqlite]
+"""
+import json
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from KnowledgeGraphApp.CompactStore import CompactStore
+from KnowledgeGraphApp.models import Triple
+from KnowledgeGraphApp.StoreSnapshot import snapshot_path, write_snapshot
+from KnowledgeGraphApp.TripleDB import db_version, db_snapshot_path, rows
+from KnowledgeGraphApp.TripleStore import file_version
+
+class Command(BaseCommand):
+    help = "Write a snapshot of each subtopic of our DB next to it (the json file or the SQLite database)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', nargs='?', default="NLPQueryApp/database/data.json",
+            help="json database, with the json backend (default: %(default)s)")
+        parser.add_argument('--subtopic', action='append',
+            help="Only build the snapshot of this subtopic (can be repeated, default: all of them)")
+        parser.add_argument('--backend', choices=['json', 'sqlite'], default=settings.NLPQUERY_KG_BACKEND,
+            help="Snapshot the json file or the Triple table (default: NLPQUERY_KG_BACKEND, %(default)s)")
+
+    def handle(self, *args, **options):
+        if options['backend'] == 'sqlite':
+            stores = self.table_stores(options['subtopic'])
+        else:
+            stores = self.file_stores(options['file'], options['subtopic'])
+        for subtopic, store, path, version in stores:
+            write_snapshot(store, path, version)
+            self.stdout.write(self.style.SUCCESS(f"{subtopic}: {len(store)} triples, {len(store.terms)} terms, "
+                f"{os.path.getsize(path)} bytes written to {path}"))
+
+    def file_stores(self, db_file, subtopics):
+        """
+        Yield (subtopic, store, snapshot path, version) for the subtopics of the json file
+        """
+        # taken before reading: if the file changes meanwhile the snapshot is stale, not wrong
+        version = file_version(db_file)
+        with open(db_file) as f:
+            data = json.load(f)
+        for subtopic in subtopics or list(data):
+            yield subtopic, CompactStore.from_data(data, subtopic), snapshot_path(db_file, subtopic), version
+
+    def table_stores(self, subtopics):
+        """
+        Yield (subtopic, store, snapshot path, version) for the subtopics of the Triple table
+        """
+        if not subtopics:
+            subtopics = Triple.objects.order_by('subtopic').values_list('subtopic', flat=True).distinct()
+        for subtopic in subtopics:
+            # taken before reading, as above: rows added meanwhile make it stale, not wrong
+            version = db_version(subtopic)
+            yield subtopic, CompactStore.from_triples(rows(subtopic)), db_snapshot_path(subtopic), version
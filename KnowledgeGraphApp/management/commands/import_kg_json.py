@@ -0,0 +1,21 @@
+"""
+Import a json database (same format as NLPQueryApp/database/data.json) into the Triple table
+Usage: python manage.py import_kg_json [FILE] [--subtopic NAME ...]
+"""
+from django.core.management.base import BaseCommand
+from KnowledgeGraphApp.TripleDB import import_json
+
+class Command(BaseCommand):
+    help = "Add the triples of a json database to the Triple table, skipping those already stored"
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', nargs='?', default="NLPQueryApp/database/data.json",
+            help="json database to import (default: %(default)s)")
+        parser.add_argument('--subtopic', action='append',
+            help="Only import this subtopic (can be repeated, default: all of them)")
+
+    def handle(self, *args, **options):
+        reports = import_json(options['file'], options['subtopic'])
+        for subtopic, report in reports.items():
+            self.stdout.write(self.style.SUCCESS(f"{subtopic}: {report.new} new, {report.merged} merged, "
+                f"{report.duplicates} duplicate triples"))
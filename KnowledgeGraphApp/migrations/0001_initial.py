@@ -0,0 +1,36 @@
+# Generated by Django 2.2 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Triple',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subtopic', models.CharField(max_length=64)),
+                ('subject', models.CharField(max_length=255)),
+                ('relation', models.CharField(max_length=255)),
+                ('object', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='triple',
+            index=models.Index(fields=['subtopic', 'object'], name='kg_triple_object'),
+        ),
+        migrations.AddIndex(
+            model_name='triple',
+            index=models.Index(fields=['subtopic', 'relation'], name='kg_triple_relation'),
+        ),
+        migrations.AddConstraint(
+            model_name='triple',
+            constraint=models.UniqueConstraint(fields=('subtopic', 'subject', 'relation', 'object'), name='kg_triple_unique'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+import json
+import os
+from django.conf import settings
+from django.db import migrations
+
+DB_FILE = os.path.join(settings.BASE_DIR, 'NLPQueryApp', 'database', 'data.json')
+BATCH_SIZE = 500
+
+
+def import_data_json(apps, schema_editor):
+    # Only the historical model here: one row per (subject, relation, object) of each
+    # json entry, in the file's order, without duplicates (see TripleDB.import_json)
+    if not os.path.exists(DB_FILE):
+        return
+    Triple = apps.get_model('KnowledgeGraphApp', 'Triple')
+    with open(DB_FILE) as f:
+        data = json.load(f)
+    for subtopic, entries in data.items():
+        seen = set()
+        new_rows = []
+        for triple_dict in entries.values():
+            for rel in triple_dict['relations']:
+                row = (triple_dict['subject'], rel, triple_dict['object'])
+                if row not in seen:
+                    seen.add(row)
+                    new_rows.append(Triple(subtopic=subtopic, subject=row[0], relation=row[1], object=row[2]))
+        Triple.objects.bulk_create(new_rows, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('KnowledgeGraphApp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(import_data_json, migrations.RunPython.noop),
+    ]
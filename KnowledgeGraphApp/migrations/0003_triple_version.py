@@ -0,0 +1,30 @@
+# Generated by Django 2.2 on 2026-10-18 13:14
+
+from django.db import migrations, models
+
+
+def add_versions(apps, schema_editor):
+    # Only the historical models here: a first version for the subtopics already stored
+    Triple = apps.get_model('KnowledgeGraphApp', 'Triple')
+    TripleVersion = apps.get_model('KnowledgeGraphApp', 'TripleVersion')
+    subtopics = Triple.objects.order_by('subtopic').values_list('subtopic', flat=True).distinct()
+    TripleVersion.objects.bulk_create([TripleVersion(subtopic=subtopic, version=1) for subtopic in subtopics])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('KnowledgeGraphApp', '0002_import_data_json'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripleVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subtopic', models.CharField(max_length=64, unique=True)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(add_versions, migrations.RunPython.noop),
+    ]
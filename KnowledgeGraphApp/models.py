@@ -0,0 +1,39 @@
+from django.db import models
+
+
+class Triple(models.Model):
+    '''
+    One (subject, relation, object) triple of our DB. A json entry with several
+    relations is stored as one row per relation. Rows are only ever added, and in
+    order, so their ids give the same triple order as the json file.
+    '''
+    subtopic = models.CharField(max_length=64)
+    subject = models.CharField(max_length=255)
+    relation = models.CharField(max_length=255)
+    object = models.CharField(max_length=255)
+
+    class Meta:
+        constraints = [
+            # also the index of lookups by subject
+            models.UniqueConstraint(fields=['subtopic', 'subject', 'relation', 'object'],
+                name='kg_triple_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['subtopic', 'object'], name='kg_triple_object'),
+            models.Index(fields=['subtopic', 'relation'], name='kg_triple_relation'),
+        ]
+
+    def __str__(self):
+        return f"{self.subtopic}: ({self.subject}, {self.relation}, {self.object})"
+
+
+class TripleVersion(models.Model):
+    '''
+    Version of the triples of a subtopic, bumped by every save that adds rows to it
+    (see TripleDB.save_triples), so checking for new triples is a single row lookup
+    '''
+    subtopic = models.CharField(max_length=64, unique=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.subtopic}: version {self.version}"
@@ -0,0 +1,136 @@
+"""
+Background parsing of uploaded documents (ingestion jobs)
+The upload request only starts a job and returns its id; a local thread pool runs
+docParse and the job's state/progress is kept in the shared 'nlpquery_jobs' cache,
+so any worker process can report it and attach the ResultsPage to the finished job.
+"""
+import hashlib
+import os
+import tempfile
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import caches
+from QueryParserApp.KeywordsParser import Parser, TextFile
+from QueryParserApp.CustomPipeline import get_pipeline
+from .results_store import store_triples
+from Web.instrumentation import stage, recording, format_stages, logger
+
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Progress is written to the cache at most every PROGRESS_INTERVAL seconds
+PROGRESS_INTERVAL = 0.5
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.NLPQUERY_INGEST_WORKERS,
+                    thread_name_prefix="nlpquery-ingest")
+    return _executor
+
+def job_key(job_id):
+    return f"job:{job_id}"
+
+def get_job(job_id):
+    """
+    State of the job: {'status', 'sid', 'doc_hash', 'sentences', 'triples', 'error', 'updated'}
+    None if there is no such job (or it expired)
+    """
+    return caches['nlpquery_jobs'].get(job_key(job_id))
+
+def set_job(job_id, job):
+    job['updated'] = time.time()
+    caches['nlpquery_jobs'].set(job_key(job_id), job, settings.NLPQUERY_RESULTS_TTL)
+
+def touch_job(job_id):
+    """
+    Keep the finished job for another NLPQUERY_RESULTS_TTL, like its triples (see
+    results_data.load), while the user is still asking questions on its ResultsPage
+    """
+    caches['nlpquery_jobs'].touch(job_key(job_id), settings.NLPQUERY_RESULTS_TTL)
+
+def spool_upload(upload):
+    """
+    Copy the uploaded file (None if there is none) chunk by chunk to a temporary file
+    for the job to parse after the request is over.
+    Return (path of the file, sha256 of its content)
+    """
+    doc_hash = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(prefix="nlpquery-upload-", delete=False) as f:
+        if upload is not None:
+            for data in upload.chunks():
+                doc_hash.update(data)
+                f.write(data)
+    return f.name, doc_hash.hexdigest()
+
+def submit_job(sid, path, doc_hash):
+    """
+    Start parsing the document saved at path (see spool_upload) in the background for
+    the session sid. The file is deleted once parsed.
+    Return the id of the new job.
+    """
+    job_id = uuid.uuid4().hex
+    job = {'status': RUNNING, 'sid': sid, 'doc_hash': doc_hash, 'sentences': 0, 'triples': 0, 'error': None}
+    set_job(job_id, job)
+    get_executor().submit(run_job, job_id, job, path)
+    return job_id
+
+def run_job(job_id, job, path):
+    """
+    Parse the document at path, updating the job's progress (sentences processed,
+    triples found) as it goes, then store the triples where results_data.load will find them.
+    job is the job's state as submitted, it is only written to the cache, never read back.
+    The document is read and decoded piece by piece, never as a whole.
+    A document parsed before is answered from the parsed-document cache (see DocCache).
+    """
+    start = time.perf_counter()
+    try:
+        with recording() as stages:
+            custom_pipe = get_pipeline()
+            print(f"Step 3: Parsing your Document... (job {job_id})")
+            triples_ls = []
+            last_update = time.monotonic()
+            with stage('job.parse_document') as timing:
+                # the upload's hash, computed while spooling it, keys the parsed-document cache
+                file = Parser(TextFile(path), custom_pipe, job['doc_hash'])
+                for sent_triples in file.docStream(n_process=settings.NLPQUERY_PARSE_PROCESSES):
+                    triples_ls += sent_triples
+                    job['sentences'] += 1
+                    job['triples'] = len(triples_ls)
+                    if time.monotonic() - last_update > PROGRESS_INTERVAL:
+                        set_job(job_id, job)
+                        last_update = time.monotonic()
+                timing.add(sentences=job['sentences'], triples=job['triples'])
+            store_triples(job['sid'], job['doc_hash'], triples_ls)
+            job['status'] = DONE
+    except Exception as e:
+        job['status'] = FAILED
+        job['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        os.remove(path)
+        set_job(job_id, job)
+        logger.info("job %s %s %.1fms %s", job_id, job['status'], (time.perf_counter() - start) * 1000,
+            format_stages(stages))
+
+def job_status(job):
+    """
+    Public part of the job's state (returned by the progress endpoint).
+    A running job not updated for NLPQUERY_JOB_STALE seconds is reported as failed:
+    its worker process is gone (e.g. restarted) and it will never finish.
+    """
+    status = job['status']
+    error = job['error']
+    if status == RUNNING and time.time() - job['updated'] > settings.NLPQUERY_JOB_STALE:
+        status = FAILED
+        error = "Parsing was interrupted, please upload your document again"
+    return {'status': status, 'sentences': job['sentences'], 'triples': job['triples'], 'error': error}
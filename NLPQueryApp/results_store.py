@@ -0,0 +1,88 @@
+"""
+Per-session storage of the results shown on the ResultsPage
+"""
+import json
+import uuid
+import zlib
+from django.conf import settings
+from django.core.cache import caches
+
+class results_data(object):
+    """
+    Information that need to be stored when changing from MainPage to ResultsPage.
+    The small fields live in the user's session, the (possibly large) triples_ls in the
+    shared 'nlpquery_results' cache keyed by session and document hash, so any worker
+    process can answer the user's follow-up questions without parsing the document again.
+    """
+    def __init__(self, subtopic, triples_ls, ents_set, rels_set, doc_hash=None):
+        self.db_file = "NLPQueryApp/database/data.json"
+        self.subtopic = subtopic
+        self.triples_ls = triples_ls
+        self.ents_set = ents_set
+        self.rels_set = rels_set
+        # sha256 of the uploaded document, identifies it in the rendered-graph cache
+        self.doc_hash = doc_hash
+
+    def save_session(self, request):
+        """
+        Store everything but triples_ls in the session, the triples are stored
+        separately by the background ingestion job (see NLPQueryApp.jobs)
+        """
+        request.session['nlpquery_results'] = {
+            'subtopic': self.subtopic,
+            'doc_hash': self.doc_hash,
+            'ents': sorted(self.ents_set),
+            'rels': sorted(self.rels_set),
+        }
+
+    @classmethod
+    def load(cls, request):
+        """
+        Return the results stored for this user's session, None if there are none
+        (no document asked about yet, or its triples expired after NLPQUERY_RESULTS_TTL)
+        """
+        stored = request.session.get('nlpquery_results')
+        if not stored:
+            return None
+        results_cache = caches['nlpquery_results']
+        key = triples_key(session_id(request), stored['doc_hash'])
+        packed = results_cache.get(key)
+        if packed is None:
+            return None
+        # keep the triples alive while the user is still asking questions about them
+        results_cache.touch(key, settings.NLPQUERY_RESULTS_TTL)
+        return cls(stored['subtopic'], unpack_triples(packed), set(stored['ents']),
+            set(stored['rels']), stored['doc_hash'])
+
+def session_id(request):
+    """
+    Random id of the user's session (created on first use), stored in the session itself
+    """
+    sid = request.session.get('nlpquery_sid')
+    if sid is None:
+        sid = uuid.uuid4().hex
+        request.session['nlpquery_sid'] = sid
+    return sid
+
+def triples_key(sid, doc_hash):
+    return f"triples:{sid}:{doc_hash}"
+
+def store_triples(sid, doc_hash, triples_ls):
+    caches['nlpquery_results'].set(triples_key(sid, doc_hash), pack_triples(triples_ls),
+        settings.NLPQUERY_RESULTS_TTL)
+
+def pack_triples(triples_ls):
+    """
+    Compact form of a list of (subject, relation, object) triples: every distinct term is
+    stored once and each triple as 3 indexes into that table, then zlib compressed
+    """
+    terms = {}
+    flat = []
+    for triple in triples_ls:
+        for term in triple:
+            flat.append(terms.setdefault(term, len(terms)))
+    return zlib.compress(json.dumps([list(terms), flat], separators=(',', ':')).encode("utf-8"))
+
+def unpack_triples(packed):
+    terms, flat = json.loads(zlib.decompress(packed).decode("utf-8"))
+    return [(terms[flat[i]], terms[flat[i + 1]], terms[flat[i + 2]]) for i in range(0, len(flat), 3)]
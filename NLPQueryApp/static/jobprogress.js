@@ -0,0 +1,30 @@
+/*
+ * Poll the progress of the ingestion job shown on the processing page
+ * and go to its ResultsPage once the document is parsed.
+ */
+(function () {
+  var POLL_MS = 1000;
+  var progress = document.getElementById("job-progress");
+  if (!progress) {
+    return;
+  }
+
+  function poll() {
+    fetch(progress.dataset.progressUrl, {credentials: "same-origin"})
+      .then(function (response) { return response.json(); })
+      .then(function (job) {
+        if (job.status === "done") {
+          window.location.href = progress.dataset.resultsUrl;
+          return;
+        }
+        if (job.status === "failed" || job.error) {
+          progress.textContent = "Parsing failed: " + job.error;
+          return;
+        }
+        progress.textContent = job.sentences + " sentences processed, " + job.triples + " triples found";
+        setTimeout(poll, POLL_MS);
+      })
+      .catch(function () { setTimeout(poll, POLL_MS); });
+  }
+  setTimeout(poll, POLL_MS);
+})();
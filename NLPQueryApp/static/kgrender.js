@@ -0,0 +1,74 @@
+/*
+ * Draw the 6 KG sections of the ResultsPage from the json payload of KnowledgeGraph.KGgraph
+ * (a list of {title, nodes: [[name, 'ent'|'rel']], edges: [[source, target]]}).
+ * Same look as the matplotlib version: circular layout, blue entities, red relations.
+ */
+(function () {
+  var SVG_NS = "http://www.w3.org/2000/svg";
+  var SIZE = 400;          // each panel is SIZE x SIZE px, 2 per row (like the 8x12 inch figure)
+  var RADIUS = 120;        // radius of the circular layout
+  var NODE_RADIUS = 8;
+  var COLORS = {ent: "blue", rel: "red"};
+
+  function el(name, attrs, text) {
+    var node = document.createElementNS(SVG_NS, name);
+    for (var key in attrs) {
+      node.setAttribute(key, attrs[key]);
+    }
+    if (text !== undefined) {
+      node.textContent = text;
+    }
+    return node;
+  }
+
+  // same positions as networkx.circular_layout: node i at angle 2*pi*i/n, y axis pointing up
+  function circularLayout(n) {
+    var pos = [];
+    for (var i = 0; i < n; i++) {
+      var theta = n === 1 ? 0 : 2 * Math.PI * i / n;
+      var r = n === 1 ? 0 : RADIUS;
+      pos.push([SIZE / 2 + r * Math.cos(theta), SIZE / 2 + 20 - r * Math.sin(theta)]);
+    }
+    return pos;
+  }
+
+  function drawPanel(panel, index) {
+    var svg = el("svg", {width: SIZE, height: SIZE, viewBox: "0 0 " + SIZE + " " + SIZE});
+    var markerId = "kg-arrow-" + index;
+    var defs = el("defs", {});
+    var marker = el("marker", {id: markerId, viewBox: "0 0 10 10", refX: 10 + NODE_RADIUS, refY: 5,
+                               markerWidth: 8, markerHeight: 8, orient: "auto"});
+    marker.appendChild(el("path", {d: "M 0 0 L 10 5 L 0 10 z", fill: "black"}));
+    defs.appendChild(marker);
+    svg.appendChild(defs);
+    svg.appendChild(el("text", {x: SIZE / 2, y: 28, "text-anchor": "middle", "font-size": 20}, panel.title));
+
+    if (!panel.nodes.length) {
+      svg.appendChild(el("text", {x: SIZE / 2, y: SIZE / 2, "text-anchor": "middle", "font-size": 12,
+                                  fill: "red"}, "No Match Found"));
+      return svg;
+    }
+    var pos = circularLayout(panel.nodes.length);
+    panel.edges.forEach(function (edge) {
+      var a = pos[edge[0]], b = pos[edge[1]];
+      svg.appendChild(el("line", {x1: a[0], y1: a[1], x2: b[0], y2: b[1], stroke: "black",
+                                  "stroke-width": 1, "marker-end": "url(#" + markerId + ")"}));
+    });
+    panel.nodes.forEach(function (node, i) {
+      svg.appendChild(el("circle", {cx: pos[i][0], cy: pos[i][1], r: NODE_RADIUS,
+                                    fill: COLORS[node[1]], "fill-opacity": 0.9}));
+      svg.appendChild(el("text", {x: pos[i][0], y: pos[i][1] + 4, "text-anchor": "middle",
+                                  "font-size": 12}, node[0]));
+    });
+    return svg;
+  }
+
+  var data = document.getElementById("kg-data");
+  var container = document.getElementById("kg-panels");
+  if (!data || !container) {
+    return;
+  }
+  JSON.parse(data.textContent).forEach(function (panel, i) {
+    container.appendChild(drawPanel(panel, i));
+  });
+})();
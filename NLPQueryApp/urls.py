@@ -4,6 +4,8 @@ from . import views
 
 urlpatterns = [
     path('', views.home, name="nlpquery-home"),
+    path('jobs/<slug:job_id>', views.job_progress, name="nlpquery-job"),
+    path('results/<slug:job_id>', views.job_results, name="nlpquery-results"),
     # path('home', views.homepage, name="homepage"),
     path('contacts', views.contactpage, name="contactpage")
 ]
\ No newline at end of file
@@ -1,32 +1,20 @@
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, Http404
+from django.conf import settings
+from django.core.cache import caches
+from django.shortcuts import redirect
+from django.urls import reverse
 from .forms import NLPQueryForm
+from .results_store import results_data, session_id
+from .jobs import spool_upload, submit_job, get_job, touch_job, job_status, DONE, FAILED
 from KnowledgeGraphApp.KGbuild import KnowledgeGraph 
 from QueryParserApp.KeywordsParser import Parser
-from QueryParserApp.CustomPipeline import Pipeline
+from QueryParserApp.CustomPipeline import get_pipeline
+from Web.instrumentation import stage
+import hashlib
+import json
 import os
 
-class results_data(object):
-    """
-    Information that need to be stored when changing from MainPage to ResultsPage
-    """
-    def __init__(self, subtopic, triples_ls, ents_set, rels_set):
-        self.db_file = "NLPQueryApp/database/data.json"
-        self.subtopic = subtopic
-        self.triples_ls = triples_ls
-        self.ents_set = ents_set
-        self.rels_set = rels_set
-    
-    def update(self, subtopic, triples_ls, ents_set, rels_set):
-        self.subtopic = subtopic
-        self.triples_ls = triples_ls
-        self.ents_set = ents_set
-        self.rels_set = rels_set
-
-my_results = results_data(None, None, None, None)
-print("Step 1: Building Custom Spacy Pipeline...\n")
-custom_pipe = Pipeline()
-
 def homepage(request):
     return render(request, 'home.html')
 
@@ -39,71 +27,140 @@ def home(request):
     """
     # If Submit button is Clicked, get form data
     if request.method == 'POST':
+        custom_pipe = get_pipeline()
         if 'home_question_sub' in request.POST:
             form = NLPQueryForm(request.POST)
             question = form['question'].value()
             subtopic = form['subtopic'].value()
-            #declaration of empty document incase no Doc were parsed
-            document = bytearray()
-            if 'document' in request.FILES:
-                    document = request.FILES['document'].read()
-            document = document.decode("utf-8")
+            # saved to a temporary file chunk by chunk (an empty one incase no Doc were uploaded),
+            # it is only read back piece by piece by the parsing job
+            path, doc_hash = spool_upload(request.FILES.get('document'))
 
             # Parsing question
             print("\nStep 2: Parsing your Question...")
             qu = Parser(question, custom_pipe)
             ents_set, rels_set = qu.questionParse()
 
-            # Parsing document
-            print("Step 3: Parsing your Document...")
-            file = Parser(document, custom_pipe)
-            triples_ls = file.docParse()
-
-            my_results.update(subtopic, triples_ls, ents_set, rels_set)
-            return results(request, my_results.subtopic, my_results.triples_ls, 
-                my_results.ents_set, my_results.rels_set, custom_pipe)
+            # Parsing document, in the background: the page polls the job's progress
+            # and moves on to the ResultsPage once it is done
+            my_results = results_data(subtopic, None, ents_set, rels_set, doc_hash)
+            my_results.save_session(request)
+            job_id = submit_job(session_id(request), path, doc_hash)
+            return processing(request, job_id)
 
         else:
-            return results(request, my_results.subtopic, my_results.triples_ls,
-                my_results.ents_set, my_results.rels_set, custom_pipe)
+            my_results = results_data.load(request)
+            if my_results is None:
+                # nothing (or nothing recent enough) stored for this session, start again
+                return redirect('nlpquery-home')
+            return results(request, my_results, custom_pipe)
 
     form = NLPQueryForm()
     #renders html code from templates folder
     return render(request, 'home.html', {'form': form})
 
-def results(request,subtopic,triples_ls,ents_set, rels_set, custom_pipe):
+def processing(request, job_id):
+    """
+    Page shown while the document is parsed, polls job_progress until the job is done
+    """
+    context = {
+        'progress_url': reverse('nlpquery-job', args=[job_id]),
+        'results_url': reverse('nlpquery-results', args=[job_id]),
+    }
+    return render(request, 'processing.html', context)
+
+def job_progress(request, job_id):
+    """
+    Progress of an ingestion job as json: status ('running', 'done' or 'failed'),
+    sentences processed, triples found and error message
+    """
+    job = get_job(job_id)
+    if job is None or job['sid'] != session_id(request):
+        return JsonResponse({'error': "Unknown job"}, status=404)
+    return JsonResponse(job_status(job))
+
+def job_results(request, job_id):
+    """
+    ResultsPage of the document parsed by the ingestion job job_id
+    """
+    job = get_job(job_id)
+    if job is None or job['sid'] != session_id(request):
+        raise Http404("Unknown job")
+    status = job_status(job)['status']
+    if status != DONE:
+        return processing(request, job_id) if status != FAILED else redirect('nlpquery-home')
+    my_results = results_data.load(request)
+    if my_results is None or my_results.doc_hash != job['doc_hash']:
+        # results expired, or another document was uploaded since
+        return redirect('nlpquery-home')
+    # the question form posts back here: the job must last as long as the triples
+    touch_job(job_id)
+    return results(request, my_results, get_pipeline())
+
+def results(request, my_results, custom_pipe):
     """
     ResultsPage
+    my_results is the results_data of this user's session
     """
-    if request.method == 'POST':
-        form = NLPQueryForm(request.POST)
-        # cwd = os.getcwd()
-        # print("cwd:",cwd)
-        KG = KnowledgeGraph(my_results.db_file, my_results.subtopic, my_results.triples_ls)
+    form = NLPQueryForm(request.POST)
+    # cwd = os.getcwd()
+    # print("cwd:",cwd)
+    KG = KnowledgeGraph(my_results.db_file, my_results.subtopic, my_results.triples_ls,
+        private_db=settings.NLPQUERY_PRIVATE_DB, backend=settings.NLPQUERY_KG_BACKEND)
 
-        # 2nd run onwards (if a new question is being asked in the Results page)
-        if 'results_question_sub' in request.POST:
-            question = form['question'].value()
-            
-            print("\nParsing new Questions...")
-            qu = Parser(question, custom_pipe)
-            ents_set, rels_set = qu.questionParse()
-            entities = ', '.join(str(s) for s in ents_set)
-            relations = ', '.join(str(s) for s in rels_set)
-
-            print("Replotting Graphs\n")
-            KG.KGdraw(ents_set, rels_set) 
-            main_html_str = KG.main_html_str
-            return render(request, 'results.html', {'main_html_str': main_html_str, 
-                'entities': entities, 'relations': relations})
+    # 2nd run onwards (if a new question is being asked in the Results page)
+    if 'results_question_sub' in request.POST:
+        question = form['question'].value()
         
-        # 1st run: from Home page to Results page
+        print("\nParsing new Questions...")
+        qu = Parser(question, custom_pipe)
+        ents_set, rels_set = qu.questionParse()
+        entities = ', '.join(str(s) for s in ents_set)
+        relations = ', '.join(str(s) for s in rels_set)
+
+        print("Replotting Graphs\n")
+        context = draw_graph(KG, my_results.doc_hash, ents_set, rels_set)
+        context.update({'entities': entities, 'relations': relations})
+        return render(request, 'results.html', context)
+    
+    # 1st run: from Home page to Results page
+    else:
+        entities = ', '.join(str(s) for s in my_results.ents_set)
+        relations = ', '.join(str(s) for s in my_results.rels_set)
+
+        print("Step 4: Returning results. Graph plotting.\n")
+        context = draw_graph(KG, my_results.doc_hash, my_results.ents_set, my_results.rels_set)
+        context.update({'entities': entities, 'relations': relations})
+        return render(request, 'results.html', context)
+
+def draw_graph(KG, doc_hash, ents_set, rels_set):
+    """
+    Template context for the KG section of the ResultsPage, depending on NLPQUERY_RENDER_MODE:
+    'json' sends the nodes/edges of the 6 graphs to be drawn by the browser,
+    'mpld3' plots them with matplotlib and sends the resulting html.
+    Finished payloads are kept in the 'kg_graphs' cache, so asking again about the same
+    document and entities/relations does not search and draw the KG again.
+    """
+    mode = settings.NLPQUERY_RENDER_MODE
+    graph_cache = caches['kg_graphs']
+    key = graph_cache_key(mode, doc_hash, KG.subtopic, KG.db_version(), ents_set, rels_set)
+    context = graph_cache.get(key)
+    if context is not None:
+        return context
+
+    with stage('kg.render', **{mode: 1}):
+        if mode == 'json':
+            context = {'graph_panels': KG.KGgraph(ents_set, rels_set)}
         else:
-            entities = ', '.join(str(s) for s in my_results.ents_set)
-            relations = ', '.join(str(s) for s in my_results.rels_set)
-
-            print("Step 4: Returning results. Graph plotting.\n")
-            KG.KGdraw(my_results.ents_set, my_results.rels_set)
-            main_html_str = KG.main_html_str
-            return render(request, 'results.html', {'main_html_str': main_html_str,
-                'entities': entities, 'relations': relations})
\ No newline at end of file
+            KG.KGdraw(ents_set, rels_set)
+            context = {'main_html_str': KG.main_html_str}
+    graph_cache.set(key, context)
+    return context
+
+def graph_cache_key(mode, doc_hash, subtopic, db_version, ents_set, rels_set):
+    """
+    Cache key of a rendered KG. db_version changes whenever the DB is written to
+    (e.g. by KGsave), so graphs drawn from an older DB are never served again.
+    """
+    parts = [mode, doc_hash, subtopic, list(db_version), sorted(ents_set), sorted(rels_set)]
+    return "kg:" + hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
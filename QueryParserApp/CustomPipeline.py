@@ -2,23 +2,155 @@
 Creating custom pipeline that can parse custom entities
 """
 import spacy
-from spacy.tokens import Span
+from spacy.language import Language
+from spacy.tokens import Doc, DocBin, Span
 from spacy.matcher import PhraseMatcher, Matcher
 import inflect
+import hashlib
+import importlib.metadata
+import json
 import os
+import shutil
+import tempfile
+import threading
+from .ParseCache import LRUCache
+
+CONTENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "content")
+KEYWORD_FILES = {
+    'compound': os.path.join(CONTENT_DIR, "compound_keywords.txt"),
+    'simple': os.path.join(CONTENT_DIR, "simple_keywords.txt"),
+}
+# The fully built pipeline (nlp.to_disk) is cached here, one folder per pipeline version
+ARTIFACT_DIR = os.path.join(CONTENT_DIR, "pipeline_cache")
+# Bump whenever the custom components change so that old artifacts get rebuilt
+ARTIFACT_VERSION = 3
+# Number of parsed questions each process keeps (see Parser.questionParse), 0 disables the cache
+QUESTION_CACHE_SIZE = int(os.environ.get("NLPQUERY_QUESTION_CACHE_SIZE", 256))
+# '<host>:<port>' of the parsing service (see ParseService), if set get_pipeline
+# returns a RemotePipeline and this process never loads spaCy models itself
+PARSE_SERVICE = os.environ.get("NLPQUERY_PARSE_SERVICE")
+
+# Components each task actually needs, the others are disabled for that call only.
+# 'sentences' (sentence segmentation and is_simple) only needs the parser.
+# 'triples' annotates the Simple sentences already parsed by 'sentences' (see
+# Pipeline.annotate): the entities (compound_keynouns, ner, simple_keynouns) and the
+# lemmas (tagger) used by relation_matcher, everything but the parser.
+# 'question' needs all of them: entities, and relations from the parse and lemmas.
+PROFILES = {
+    'question': ('tagger', 'parser', 'compound_keynouns', 'ner', 'simple_keynouns', 'relation_matcher'),
+    'sentences': ('parser',),
+    'triples': ('tagger', 'compound_keynouns', 'ner', 'simple_keynouns', 'relation_matcher'),
+}
 
 class Pipeline(object):
-    def __init__(self):	
-        nlp = spacy.load("en_core_web_sm")
-        self.nlp = self.pipeline(nlp)
+    # parsing runs in this process (see ParseService.RemotePipeline)
+    remote = False
+
+    def __init__(self, use_artifact=True, question_cache_size=QUESTION_CACHE_SIZE):
+        """
+        Load the pipeline from its cached artifact in ARTIFACT_DIR, or build it from
+        en_core_web_sm and the keyword files (and save the artifact for next time).
+        The artifact is rebuilt whenever the content of the keyword files changes.
+        question_cache_size is the number of (ents_set, rels_set) results kept per question
+        """
+        self.version = self.pipeline_version()
+        artifact = os.path.join(ARTIFACT_DIR, self.version)
+        nlp = None
+        if use_artifact and os.path.exists(os.path.join(artifact, "meta.json")):
+            try:
+                nlp = spacy.load(artifact)
+            except Exception as e:
+                print(f"Could not load the cached pipeline ({e}), rebuilding it...")
+                shutil.rmtree(artifact, ignore_errors=True)
+        if nlp is None:
+            nlp = self.pipeline(spacy.load("en_core_web_sm"))
+            if use_artifact:
+                self.save_artifact(nlp, artifact)
+        self.nlp = nlp
+        # compiled once, shared by every Parser (also for docs that skipped the component)
+        self.relation_matcher = nlp.get_pipe('relation_matcher')
+        # (version, normalised question) -> (ents frozenset, rels frozenset)
+        self.question_cache = LRUCache(question_cache_size)
+
+    def disabled(self, task):
+        """
+        Names of the components PROFILES[task] does not need, to pass as
+        nlp(text, disable=...) or nlp.pipe(texts, disable=...): they are skipped for
+        that call only, so concurrent calls with other profiles are not affected
+        """
+        return [name for name in self.nlp.pipe_names if name not in PROFILES[task]]
+
+    def annotate(self, docs, task, batch_size=256):
+        """
+        Run the components of PROFILES[task] (in pipeline order) over docs that are
+        already tokenized, e.g. Span.as_doc copies of parsed sentences, which keep
+        their parse. Return an iterator of the annotated docs.
+        """
+        docs = (self.own_tensor(doc) for doc in docs)
+        for name, proc in self.nlp.pipeline:
+            if name not in PROFILES[task]:
+                continue
+            if hasattr(proc, 'pipe'):
+                docs = proc.pipe(docs, batch_size=batch_size)
+            else:
+                docs = (proc(doc) for doc in docs)
+        return iter(docs)
+
+    @staticmethod
+    def own_tensor(doc):
+        # Span.as_doc copies share a view of the parsed doc's tensor, which the tagger
+        # cannot extend in place (Doc.extend_tensor)
+        doc.tensor = doc.tensor.copy()
+        return doc
+
+    def pipeline_version(self):
+        """
+        Hash of everything the built pipeline depends on: the keyword files' content,
+        the custom components (ARTIFACT_VERSION) and the spaCy/model versions
+        """
+        h = hashlib.sha256()
+        h.update(f"{ARTIFACT_VERSION}/{spacy.__version__}/".encode())
+        h.update(importlib.metadata.version("en_core_web_sm").encode())
+        for name in sorted(KEYWORD_FILES):
+            with open(KEYWORD_FILES[name], "rb") as f:
+                h.update(f.read())
+        return h.hexdigest()[:16]
+
+    def save_artifact(self, nlp, artifact):
+        """
+        nlp.to_disk into a temporary folder then rename it, so other workers starting
+        at the same time never load a half-written artifact. Other versions are kept
+        (processes still running an older version during a deploy may use them),
+        see prune_artifacts.
+        """
+        os.makedirs(ARTIFACT_DIR, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=ARTIFACT_DIR, prefix=".tmp-")
+        try:
+            nlp.to_disk(tmp_dir)
+            os.rename(tmp_dir, artifact)
+        except OSError:
+            # another worker saved the same version first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def prune_artifacts(self):
+        """
+        Delete the artifacts of every other pipeline version (python manage.py build_pipeline --prune).
+        Return their names.
+        """
+        pruned = []
+        for name in os.listdir(ARTIFACT_DIR):
+            if name != self.version and not name.startswith(".tmp-"):
+                shutil.rmtree(os.path.join(ARTIFACT_DIR, name), ignore_errors=True)
+                pruned.append(name)
+        return pruned
 
     def pipeline(self, nlp):
         compound_ls = []; simple_ls = []
-        with open("./QueryParserApp/content/compound_keywords.txt", "r", encoding="ISO-8859-1") as f:
+        with open(KEYWORD_FILES['compound'], "r", encoding="ISO-8859-1") as f:
             keyterms = f.readlines()
             keyterms = self.clean_keyterms(keyterms)
             compound_ls.extend(keyterms)
-        with open("./QueryParserApp/content/simple_keywords.txt", "r", encoding="ISO-8859-1") as f:
+        with open(KEYWORD_FILES['simple'], "r", encoding="ISO-8859-1") as f:
             keyterms = f.readlines()
             keyterms = self.clean_keyterms(keyterms)
             simple_ls.extend(keyterms)
@@ -30,6 +162,8 @@ class Pipeline(object):
 
         entity_matcher = SimpleEntityMatcher(nlp, simple_ls, 'Simple_Keynouns')
         nlp.add_pipe(entity_matcher, after='ner')        
+
+        nlp.add_pipe(RelationMatcher(nlp), last=True)
         return nlp
 
     def clean_keyterms(self, keyterms):
@@ -56,6 +190,38 @@ class Pipeline(object):
         phrase_list += plural_list
         return phrase_list
 
+# The Pipeline is built lazily, once per process, by the first caller of get_pipeline()
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def get_pipeline():
+    """
+    Return the process-wide Pipeline, building it on first use.
+    Thread-safe: concurrent first callers wait for a single build.
+    When NLPQUERY_PARSE_SERVICE is set, return a RemotePipeline using that service.
+    """
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None and PARSE_SERVICE:
+                from .ParseService import RemotePipeline
+                _pipeline = RemotePipeline(PARSE_SERVICE)
+            elif _pipeline is None:
+                print("Step 1: Building Custom Spacy Pipeline...\n")
+                _pipeline = Pipeline()
+    return _pipeline
+
+def warm_up(background=True):
+    """
+    Build the Pipeline ahead of the first request.
+    By default this runs in a daemon thread so server start is not delayed.
+    """
+    if not background:
+        return get_pipeline()
+    thread = threading.Thread(target=get_pipeline, name="pipeline-warm-up", daemon=True)
+    thread.start()
+    return thread
+
 # Ref (to build custom pipe): https://support.prodi.gy/t/adding-a-custom-ner-to-a-pipeline-overrides-an-original-ner/837
 
 ## First custom matcher will look for compound keynouns.
@@ -65,54 +231,141 @@ class Pipeline(object):
 ## So we will need to add if after NER (last in our pipeline)
 ## E.g: the phrase "stock market" should have been parsed as an ent. We won't mark "stock" as another ent
 
-class CompoundEntityMatcher(object):
+class KeytermMatcher(object):
     '''
-    This custom matcher will be added before 'ner' in our pipeline.
-    It will find "Financial-related" entities from our compound_list.
+    Base of our 2 custom matchers: a PhraseMatcher over a list of keyterms.
+    The tokenized keyterms (pattern Docs) are saved by nlp.to_disk, so spacy.load
+    rebuilds the matcher from the artifact without reading the keyword files,
+    pluralising or tokenizing them again.
     '''
-    name = 'compound_keynouns'
-
     def __init__(self, nlp, terms, label):
-        patterns = [nlp.make_doc(term) for term in terms]
-        self.matcher = PhraseMatcher(nlp.vocab)
-        self.matcher.add(label, None, *patterns)
+        self.nlp = nlp
+        self.label = label
+        self.set_patterns(list(self.nlp.tokenizer.pipe(terms)))
 
-    def __call__(self, doc):
-        matches = self.matcher(doc)
+    def set_patterns(self, patterns):
+        self.patterns = patterns
+        self.terms = [pattern.text for pattern in patterns]
+        self.matcher = PhraseMatcher(self.nlp.vocab)
+        self.matcher.add(self.label, None, *patterns)
+
+    def add_entities(self, doc):
+        """
+        Add the keyterm matches to doc.ents, except those overlapping an existing entity
+        or a longer match. A byte per token of doc records which tokens already belong
+        to an entity, so each match is checked without comparing it to every entity.
+        """
+        covered = bytearray(len(doc))
+        for ent in doc.ents:
+            covered[ent.start:ent.end] = b'\x01' * (ent.end - ent.start)
         spans = []
-        for label, start, end in matches:
-            span = Span(doc, start, end, label=label)
-            spans.append(span)
+        # longest matches first so e.g. "stock market index" wins over "stock market"
+        for label, start, end in sorted(self.matcher(doc), key=lambda m: (m[1] - m[2], m[1])):
+            if covered.find(1, start, end) != -1:
+                continue
+            covered[start:end] = b'\x01' * (end - start)
+            spans.append(Span(doc, start, end, label=label))
         doc.ents = list(doc.ents) + spans
         return doc
 
-class SimpleEntityMatcher(object):
+    def to_disk(self, path, exclude=tuple(), **kwargs):
+        path = str(path)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "cfg.json"), "w") as f:
+            json.dump({'label': self.label}, f)
+        # only the tokens (ORTH) are matched, so only they are stored
+        patterns = DocBin(attrs=["ORTH"])
+        for pattern in self.patterns:
+            patterns.add(pattern)
+        with open(os.path.join(path, "patterns.bin"), "wb") as f:
+            f.write(patterns.to_bytes())
+
+    def from_disk(self, path, exclude=tuple(), **kwargs):
+        path = str(path)
+        with open(os.path.join(path, "cfg.json")) as f:
+            self.label = json.load(f)['label']
+        with open(os.path.join(path, "patterns.bin"), "rb") as f:
+            patterns = DocBin().from_bytes(f.read())
+        self.set_patterns(list(patterns.get_docs(self.nlp.vocab)))
+        return self
+
+class CompoundEntityMatcher(KeytermMatcher):
+    '''
+    This custom matcher will be added before 'ner' in our pipeline.
+    It will find "Financial-related" entities from our compound_list.
+    '''
+    name = 'compound_keynouns'
+
+    def __call__(self, doc):
+        return self.add_entities(doc)
+
+class SimpleEntityMatcher(KeytermMatcher):
     '''
     This custom matcher will be added after 'ner' in our pipeline.
     It will find "Financial-related" entities from our simple_list.
+    We don't want to set the entities previously defined by 'compound_keynouns' or 'ner' again,
+    add_entities skips every match overlapping them.
     '''
     name = 'simple_keynouns'
 
-    def __init__(self, nlp, terms, label):
-        patterns = [nlp.make_doc(term) for term in terms]
-        self.matcher = PhraseMatcher(nlp.vocab)
-        self.matcher.add(label, None, *patterns)
+    def __call__(self, doc):
+        return self.add_entities(doc)
+
+class RelationMatcher(object):
+    '''
+    This custom matcher will be added last in our pipeline (it needs the tagger and parser).
+    It finds the Relations ("key verbs") of the doc once and stores them in doc._.relations
+    as a list of (<start_index>, <relation_name>).
+    '''
+    name = 'relation_matcher'
+
+    def __init__(self, nlp):
+        self.matcher = Matcher(nlp.vocab)
+
+        #define the pattern (both patterns will be looking for a VERB followed by a PREPOSITION)
+        ROOT_pattern = [{'DEP':'ROOT'}, 
+                {'DEP':'prep','OP':"?"},
+                {'DEP':'agent','OP':"?"},
+                {'DEP':'acomp','OP':"?"},
+        ] 
+
+        acl_pattern = [{'DEP':'acl'}, 
+                {'DEP':'prep','OP':"?"},
+                {'DEP':'agent','OP':"?"},
+                {'DEP':'acomp','OP':"?"},
+        ]
+        self.matcher.add("relations", None, ROOT_pattern, acl_pattern)
 
     def __call__(self, doc):
+        doc._.relations = self.find_relations(doc)
+        return doc
+
+    def find_relations(self, doc):
         matches = self.matcher(doc)
-        spans = []
-        for label, start, end in matches:
-            span = Span(doc, start, end, label=label)
-            
-            # We don't want to set the entities previously defined by 'compound_fin_keynouns' or 'ner' again
-            duplicate = False
-            ## If already defined, we will set flag == True
-            for ent in doc.ents:
-                if (str(span) in str(ent) and ent.start <= span.end <= ent.end):
-                    duplicate = True
-                    
-            ## If flag == False (no duplicate), add it to our entities list.
-            if duplicate == False:
-                spans.append(span)
-        doc.ents = list(doc.ents) + spans
-        return doc
\ No newline at end of file
+        spans = [(start, end, doc[start:end].lemma_) for match_id, start, end in matches]
+        return self.remove_duplicates(spans)
+
+    @staticmethod
+    def remove_duplicates(spans):
+        """
+        INPUT: spans is the list of matched relations (<start_index>, <end_index>, <relation_name>)
+        OUTPUT: the relations list (<start_index>, <relation_name>) without duplication
+        Examples: "determine" and "determine by" will both be relations but we only need the longer one,
+        so a 1-token relation is dropped when its token is covered by a longer relation.
+        Linear in the number of matched tokens.
+        """
+        covered = set()
+        for start, end, _ in spans:
+            if end - start > 1:
+                covered.update(range(start, end))
+        return [(start, relation) for start, end, relation in spans
+                if end - start > 1 or start not in covered]
+
+# Relations found by RelationMatcher, None if the doc did not go through it
+Doc.set_extension('relations', default=None, force=True)
+
+# Factories so spacy.load can recreate our components from a saved artifact,
+# their keyterms are then restored by from_disk
+Language.factories['compound_keynouns'] = lambda nlp, **cfg: CompoundEntityMatcher(nlp, [], 'Compound_Keynouns')
+Language.factories['simple_keynouns'] = lambda nlp, **cfg: SimpleEntityMatcher(nlp, [], 'Simple_Keynouns')
+Language.factories['relation_matcher'] = lambda nlp, **cfg: RelationMatcher(nlp)
@@ -5,98 +5,362 @@ import spacy
 from spacy.tokens import Span
 from spacy.matcher import PhraseMatcher, Matcher
 import inflect
+import codecs
+import hashlib
 import re
+from itertools import islice
+from .Normaliser import get_normaliser
+from .ParseCache import get_doc_cache
+from Web.instrumentation import stage
+
+# Documents are split into chunks of about CHUNK_SIZE characters (cut at a sentence end)
+# and DOC_BATCH_SIZE chunks are sent to nlp.pipe at a time
+CHUNK_SIZE = 10000
+DOC_BATCH_SIZE = 16
+# Uploaded files are read and decoded READ_SIZE bytes at a time (see read_text)
+READ_SIZE = 1 << 16
+# Part of the parsed-document cache key (see doc_key): bump it whenever the triples found
+# in a document change (simplify, split_chunks, is_simple, the extraction itself)
+PARSER_VERSION = 1
+# Streamed text is simplified in batches cut at a newline with 3 word characters on each
+# side, so simplifying the batches one by one gives the same text as simplifying the whole
+# document: the bracket and '=' regexes stop at newlines, the period one needs a period
+# next to the cut, and removing the newline joins both sides into a word of 6+ letters,
+# which is no stopword (5 letters at most). With fewer letters, e.g. " th\ne ", the joined
+# word could be a stopword removed from the whole document but not from the batches.
+SAFE_CUT = re.compile(r"(?<=\w{3})\r?\n(?=\w{3})")
+# Without a SAFE_CUT (e.g. lines ending with a period) a batch is cut inside a word, between
+# 3 ASCII letters or digits on each side (the word is no stopword, lower() needs no context),
+# neither in a bracket group nor in an '=' heading removed by simplify: no pattern of
+# simplify can match across it either
+WORD_CUT = re.compile(r"(?<=[A-Za-z0-9]{3})(?=[A-Za-z0-9]{3})")
+# the bracket groups and headings of the Normaliser, or their start if not closed (yet)
+BRACKET_GROUP = re.compile(r" [\(\[].*?[\)\]]| [\(\[]")
+HEADING = re.compile(r"=.*? =|=")
+# Longest batch when neither cut is found (over 1 MB without a single word outside
+# brackets and '=' headings), cut anyway: the only case simplify may differ
+MAX_BATCH_TEXT = 1 << 20
+
+def read_text(binary_file, size=READ_SIZE):
+    """
+    Read an utf-8 file opened in binary mode piece by piece.
+    Return a generator of str (characters split between 2 reads are decoded once complete)
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while True:
+        data = binary_file.read(size)
+        if not data:
+            break
+        text = decoder.decode(data)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+class TextFile(object):
+    '''
+    An utf-8 text file given to Parser as a document: each iteration reads it again
+    piece by piece (see read_text), so it can be hashed before being parsed.
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            yield from read_text(f)
+
+def word_cut(text, start):
+    """
+    Return the first position from start where text can be cut inside a word
+    (see WORD_CUT), None if there is none
+    """
+    line_start = text.rfind('\n', 0, start) + 1
+    while line_start < len(text):
+        line_end = text.find('\n', line_start)
+        if line_end == -1:
+            line_end = len(text)
+        for lo, hi, end in cut_ranges(text, line_start, line_end):
+            if hi < start:
+                continue
+            # end (the end of the part of the line) lets WORD_CUT see the letters after hi
+            match = WORD_CUT.search(text, max(lo, start), min(end, hi + 3))
+            if match is not None and match.start() <= hi:
+                return match.start()
+        line_start = line_end + 1
+    return None
+
+def cut_ranges(text, line_start, line_end):
+    """
+    Yield the (lo, hi, end) ranges of the line where no bracket group or '=' heading of
+    simplify would be cut: positions lo to hi (included) of the part of the line between
+    2 bracket groups ending at end. A group or heading not closed yet ends the line.
+    """
+    # the parts of the line between the bracket groups: (start, end)
+    parts = []
+    position = line_start
+    for group in BRACKET_GROUP.finditer(text, line_start, line_end):
+        parts.append((position, group.start()))
+        if group.group().endswith(('(', '[')):
+            position = None
+            break
+        position = group.end()
+    if position is not None:
+        parts.append((position, line_end))
+
+    # simplify looks for the headings once the bracket groups are removed
+    line = ''.join(text[part_start:part_end] for part_start, part_end in parts)
+    free = []
+    free_start = 0
+    for heading in HEADING.finditer(line):
+        free.append((free_start, heading.start()))
+        if heading.group() == '=':
+            free_start = None
+            break
+        free_start = heading.end()
+    if free_start is not None:
+        free.append((free_start, len(line)))
+
+    # free ranges of the line (without the groups) -> ranges of each part of text
+    offset = 0
+    for part_start, part_end in parts:
+        part_length = part_end - part_start
+        for free_lo, free_hi in free:
+            lo = max(free_lo, offset)
+            hi = min(free_hi, offset + part_length)
+            if lo <= hi:
+                yield part_start + lo - offset, part_start + hi - offset, part_end
+        offset += part_length
+
+def text_batches(pieces, batch_size=CHUNK_SIZE):
+    """
+    Regroup pieces of text into batches of at least batch_size characters
+    (except the last one), each cut at a SAFE_CUT, else inside a word (see word_cut)
+    """
+    pending = ''
+    for piece in pieces:
+        # a SAFE_CUT starts at most 3 characters before the new piece
+        searched = max(len(pending) - 3, 0)
+        pending += piece
+        while len(pending) >= batch_size:
+            match = SAFE_CUT.search(pending, max(batch_size, searched))
+            if match is not None:
+                cut = match.end()
+                searched = 0
+            else:
+                cut = word_cut(pending, batch_size)
+                if cut is None:
+                    if len(pending) <= MAX_BATCH_TEXT:
+                        break
+                    cut = len(pending)
+                # what is left has been searched for a SAFE_CUT already
+                searched = max(len(pending) - cut - 3, 0)
+            yield pending[:cut]
+            pending = pending[cut:]
+    if pending:
+        yield pending
 
 class Parser(object):
-    def __init__(self, text, custom_pipe):
+    def __init__(self, text, custom_pipe, text_hash=None, use_doc_cache=True):
+        """
+        text is the question or document, a str. A document can also be an iterable
+        of str pieces (e.g. a TextFile), parsed without ever holding the whole text
+        in memory. Parse results are only cached for documents that can be read twice
+        (a str, a TextFile or a list, not a one-shot iterator such as read_text)
+        or whose text_hash is given.
+        text_hash is the sha256 (hex) of the document's utf-8 text when it is already
+        known (e.g. computed while the upload was saved), see doc_key.
+        use_doc_cache=False always parses the document, without reading or writing the cache.
+        """
         self.text = text
+        self.custom_pipe = custom_pipe
         self.nlp = custom_pipe.nlp
+        self.text_hash = text_hash
+        self.use_doc_cache = use_doc_cache
 
-    def docParse(self):
+    def docParse(self, batch_size=DOC_BATCH_SIZE, n_process=1):
         """
         To parse the whole documents but only for simple sentences at the moment.
         Return a list of triples of Subject-Verb-Object (SVO)
+        batch_size and n_process are passed on to nlp.pipe (see docStream)
+        """
+        triples = []
+        for sent_triples in self.docStream(batch_size, n_process):
+            triples += sent_triples
+        return triples
+
+    def docStream(self, batch_size=DOC_BATCH_SIZE, n_process=1):
+        """
+        Generator version of docParse: parse the document chunk by chunk and yield
+        the list of triples found in each sentence as soon as it is parsed
+        (an empty list for sentences that are not Simple).
+        batch_size is the number of texts parsed together by nlp.pipe and
+        n_process the number of processes it spreads them over.
+        With a RemotePipeline the chunks are sent to the parsing service instead.
         """
         text = self.text
-        text = self.simplify(text)
-        nlp = self.nlp
-        full_doc = nlp(text)
-        
-        # Slit into sentences and find Simple sentences
-        sent_doc_ls = list(sent for sent in full_doc.sents)
-        spl_ls = self.simple_find(sent_doc_ls)
-        doc_ls = list(nlp.pipe(spl_ls))
+        pieces = [text] if isinstance(text, str) else text
+        custom_pipe = self.custom_pipe
+
+        # A document parsed before (same text, same parser and pipeline) is not parsed again
+        doc_cache = get_doc_cache() if self.use_doc_cache else None
+        key = None
+        if doc_cache is not None and (self.text_hash is not None or iter(pieces) is not pieces):
+            with stage('doc.cache_lookup') as timing:
+                key = self.doc_key(pieces)
+                cached = doc_cache.get(key)
+                timing.add(hits=int(cached is not None))
+            if cached is not None:
+                print("Document parsed before, using its cached triples...\n")
+                yield from cached
+                return
 
         print("Finding triples (Subject-Verb-Object) from your doc...\n")
-        # Our triples will be (ent1, rel, ent2)
-        triples = self.all_triples(doc_ls)  
-        return triples
+        parsed = []
+        chunks = self.split_chunks(self.simplify(batch) for batch in text_batches(pieces))
+        if custom_pipe.remote:
+            sent_triples_stream = self.remote_stream(chunks, batch_size)
+        else:
+            sent_triples_stream = self.parse_stream(chunks, batch_size, n_process)
+        for sent_triples in sent_triples_stream:
+            if key is not None:
+                parsed.append(sent_triples)
+            yield sent_triples
+        if key is not None:
+            doc_cache.put(key, parsed)
+
+    def doc_key(self, pieces):
+        """
+        Cache key of a document: sha256 of PARSER_VERSION, the pipeline version and
+        the sha256 of its text. The text is only read for it when text_hash is not
+        given: hashing it costs little next to simplifying it.
+        """
+        text_hash = self.text_hash
+        if text_hash is None:
+            text_sha = hashlib.sha256()
+            for piece in pieces:
+                text_sha.update(piece.encode("utf-8"))
+            text_hash = text_sha.hexdigest()
+        return hashlib.sha256(f"{PARSER_VERSION}/{self.custom_pipe.version}/{text_hash}".encode("utf-8")).hexdigest()
+
+    def remote_stream(self, chunks, batch_size=DOC_BATCH_SIZE):
+        """
+        Send the chunks to the parsing service (see ParseService), batch_size at a time.
+        Yield the list of triples found in each of their sentences (see docStream)
+        """
+        while True:
+            chunk_batch = list(islice(chunks, batch_size))
+            if not chunk_batch:
+                return
+            with stage('doc.remote_parse', chunks=len(chunk_batch)):
+                sent_triples_ls = self.custom_pipe.parse_chunks(chunk_batch, batch_size)
+            yield from sent_triples_ls
+
+    def parse_chunks(self, chunk_batch, batch_size=DOC_BATCH_SIZE, n_process=1):
+        """
+        Parse a batch of chunks of simplified text (see parse_stream).
+        Return the list of triples found in each of their sentences
+        """
+        return list(self.parse_stream(chunk_batch, batch_size, n_process))
+
+    def parse_stream(self, chunks, batch_size=DOC_BATCH_SIZE, n_process=1):
+        """
+        Parse chunks of simplified text, an iterable consumed by a single nlp.pipe call
+        (so its n_process worker processes are only started once per document).
+        Yield the list of triples found in each of their sentences (see docStream)
+        """
+        custom_pipe = self.custom_pipe
+        # Split into sentences and find Simple sentences, only the parser is needed
+        docs = iter(self.nlp.pipe(chunks, batch_size=batch_size, n_process=n_process,
+            disable=custom_pipe.disabled('sentences')))
+        while True:
+            with stage('doc.parse') as timing:
+                doc = next(docs, None)
+                if doc is not None:
+                    sent_doc_ls = list(doc.sents)
+                    timing.add(chunks=1, sentences=len(sent_doc_ls), tokens=len(doc))
+            if doc is None:
+                return
+            with stage('doc.simple_find') as timing:
+                simple_flags = [self.is_simple(sent) for sent in sent_doc_ls]
+                # as_doc copies a sentence with its parse, so it is not parsed again
+                spl_doc_ls = [sent.as_doc() for sent, simple in zip(sent_doc_ls, simple_flags) if simple]
+                timing.add(simple=len(spl_doc_ls))
+            # Only Simple sentences get the other components (entities, lemmas, relations)
+            with stage('doc.annotate', sentences=len(spl_doc_ls)):
+                doc_ls = iter(list(custom_pipe.annotate(spl_doc_ls, 'triples')))
+
+            # Our triples will be (ent1, rel, ent2)
+            with stage('doc.all_triples') as timing:
+                sent_triples_ls = [self.all_triples([next(doc_ls)]) if simple else [] for simple in simple_flags]
+                timing.add(triples=sum(len(sent_triples) for sent_triples in sent_triples_ls))
+            yield from sent_triples_ls
+
+    def split_chunks(self, text, chunk_size=CHUNK_SIZE):
+        """
+        Split the simplified text into chunks of roughly chunk_size characters,
+        only cutting at the end of a sentence ('. ').
+        text is a str or an iterable of consecutive str pieces.
+        """
+        pieces = [text] if isinstance(text, str) else text
+        pending = ''
+        for piece in pieces:
+            # a '. ' can only end in the new piece (or start just before it)
+            searched = max(len(pending) - 1, 0)
+            pending += piece
+            start = 0
+            while True:
+                end = pending.find('. ', max(start + chunk_size, searched))
+                if end == -1:
+                    break
+                yield pending[start:end + 2]
+                start = end + 2
+            pending = pending[start:]
+        if pending:
+            yield pending
 
     def questionParse(self):
         """
         To parse question only. 
         Return a set of entities ents_set and a set of relations rels_set
+        Repeated questions are answered from the pipeline's question_cache.
+        With a RemotePipeline the question is sent to the parsing service instead.
         """
         text = self.text
-        text = text.lower()
-        nlp = self.nlp
-        doc = nlp(text)
-        print("Finding entities set and relations set...\n")
-        ents_set = set(str(ent) for ent in doc.ents)
-        rels_list = self.get_relation(doc)
-        rels_set = set(str(rel[-1]) for rel in rels_list)
+        # lowercase and collapse whitespace, so trivially different questions share an entry
+        text = ' '.join(text.lower().split())
+        if self.custom_pipe.remote:
+            # parsed (and cached) by the parsing service (see ParseService)
+            return self.custom_pipe.questionParse(text)
+        cache = self.custom_pipe.question_cache
+        key = (self.custom_pipe.version, text)
+        cached = cache.get(key)
+        if cached is not None:
+            return set(cached[0]), set(cached[1])
+
+        with stage('question.parse') as timing:
+            doc = self.nlp(text, disable=self.custom_pipe.disabled('question'))
+            print("Finding entities set and relations set...\n")
+            ents_set = set(str(ent) for ent in doc.ents)
+            rels_list = self.get_relation(doc)
+            rels_set = set(str(rel[-1]) for rel in rels_list)
+            timing.add(tokens=len(doc), ents=len(ents_set), rels=len(rels_set))
+        cache.put(key, (frozenset(ents_set), frozenset(rels_set)))
         return ents_set, rels_set
 
     def get_relation(self, doc):
         """
         Parsing a doc object to find the Relations ("key verbs")
         Return a set of relations rels_set (<start_index>, <relation_name>)
+        The relations are precomputed by the 'relation_matcher' pipeline component,
+        docs that did not go through it are matched with the same shared matcher.
         """
-        nlp = self.nlp
-        # Matcher class object 
-        matcher = Matcher(nlp.vocab)
-
-        #define the pattern (both patterns will be looking for a VERB followed by a PREPOSITION)
-        ROOT_pattern = [{'DEP':'ROOT'}, 
-                {'DEP':'prep','OP':"?"},
-                {'DEP':'agent','OP':"?"},
-                {'DEP':'acomp','OP':"?"},
-        ] 
-
-        acl_pattern = [{'DEP':'acl'}, 
-                {'DEP':'prep','OP':"?"},
-                {'DEP':'agent','OP':"?"},
-                {'DEP':'acomp','OP':"?"},
-        ]
-
-        relations = []
-        matcher.add("relations", None, ROOT_pattern, acl_pattern)
-        # After the matcher is added, let's run on our Doc to see what it can find
-        matches = matcher(doc)
-
-        # Store it in the relations list
-        for match_id, start, end in matches:
-            matched_span = doc[start:end]
-            relation_tuple = (start, matched_span.lemma_)
-            relations.append(relation_tuple)
-
-        # Check if there is duplication, we will remove the duplication
-        # Examples: "determine" and "determine by" will both be relations but we only need the longer one
-        for start, relation1 in relations:
-            if len(relation1.split()) != 1:
-                continue
-            else:
-                # comparing our 1st relation to our 2nd relation 
-                for _, relation2 in relations:
-                    # if 2nd relation also 1 word, won't be a duplicate
-                    if len(relation2.split()) == 1:
-                        continue
-                    # if 1st relation is a substring of 2nd relation --> duplicate
-                    if relation2.find(relation1) != -1:
-                        relations.remove((start, relation1))
-                        break
-        return relations
+        relations = doc._.relations
+        if relations is None:
+            relations = self.custom_pipe.relation_matcher.find_relations(doc)
+        return list(relations)
 
+    @stage('doc.simplify')
     def simplify(self, text):
         """
         Remove all 'a', 'the' from the text since this is not important to build the KG.
@@ -104,24 +368,9 @@ class Parser(object):
         Also turn all to lowercase.
         Also remove all texts within brackets (those adding extra information)
         Also clean up 'he she we they this these those that' since we have yet found a way to parse earlier info.
+        Done in a few compiled passes by the process-wide Normaliser.
         """
-        text = text.lower()
-        to_replace_with_space = [' a ', ' the ', ' he ', ' she ', ' we ', ' they ', ' this ', ' that ', ' these ', ' those ']
-        to_remove = ['\n', '=']
-        source = text
-        source = re.sub(" [\(\[].*?[\)\]]", "", source)
-        source = re.sub("[=].*? [=]", "", source)
-        for dummy in to_remove:
-            source = source.replace(dummy, '')
-        # clean up period as this punctuation get a bit messy after all the previous replacements
-        n = 3
-        for i in range(n):
-            dummy = '.' + ' '*(n-i)
-            source = source.replace(dummy, '.')
-        source = source.replace('.', '. ')
-        for dummy in to_replace_with_space:
-            source = source.replace(dummy, ' ')
-        return source
+        return get_normaliser()(text)
     
     def simple_find(self, doc_ls):
         """
@@ -132,18 +381,19 @@ class Parser(object):
         spl_text_ls = []
 
         for doc in doc_ls:
-            is_simple = False
-            nsubj_tok = [tok for tok in doc if tok.dep_ == "nsubj" or tok.dep_ == "nsubjpass"]
-            mark_tok = [tok for tok in doc if tok.dep_ == "mark"]; 
-
-            if len(nsubj_tok) == 1 and len(mark_tok) == 0:
-                is_simple = True
-
-            if is_simple == True:
+            if self.is_simple(doc):
                 spl_text_ls.append(doc.string.strip())
 
         return spl_text_ls
 
+    def is_simple(self, doc):
+        """
+        A Simple sentence has exactly 1 subject and no subordinating conjunction (mark)
+        """
+        nsubj_tok = [tok for tok in doc if tok.dep_ == "nsubj" or tok.dep_ == "nsubjpass"]
+        mark_tok = [tok for tok in doc if tok.dep_ == "mark"]
+        return len(nsubj_tok) == 1 and len(mark_tok) == 0
+
     def all_triples(self, doc_ls):
         """
         Find all triples from the document object
@@ -160,32 +410,28 @@ class Parser(object):
         '''
         Parse a `doc` object and return entities and the relations between them in order
         '''
-        ent_list = []; relation_list = []
-        for ent in doc.ents:
-            ent_tuple = (ent.end - 1, ent.lemma_, "ents")
-            ent_list.append(ent_tuple)
-
-        relations = self.get_relation(doc)
-        for start, relation in relations:
-            relation_tuple = (start, relation, "rels")
-            relation_list.append(relation_tuple)
-
-        combined_list = ent_list + relation_list
-        ordered_list = sorted(combined_list, key=lambda x: x[0])
-        # check ordered list for tuple of ents follow by rels:
-        # if ents.end >= rels.start, False, remove relations
-        n = len(ordered_list)
-        remove_list = []
-        for i in range(n-1):
-            tuple1 = ordered_list[i]
-            tuple2 = ordered_list[i+1]
-            if tuple1[-1] == 'ents' and tuple2[-1] == 'rels':
-                if tuple1[0] >= tuple2[0]:
-                    remove_list.append(tuple2)
-        for trash in remove_list:
-            ordered_list.remove(trash)
-        ordered_list = sorted(ordered_list, key=lambda x: x[0])
-        return ordered_list
+        ent_list = [(ent.end - 1, ent.lemma_, "ents") for ent in doc.ents]
+        relation_list = [(start, relation, "rels") for start, relation in self.get_relation(doc)]
+        return self.order_entity_relation(ent_list, relation_list)
+
+    @staticmethod
+    def order_entity_relation(ent_list, relation_list):
+        '''
+        Merge (index, name, "ents") and (index, name, "rels") tuples in order of their index.
+        A relation right after an entity ending at or after the relation's start is dropped
+        (the "relation" is part of that entity). One sort and one pass over the list.
+        '''
+        # sort is stable: for equal indexes entities stay before relations
+        ordered_list = sorted(ent_list + relation_list, key=lambda x: x[0])
+        cleaned_list = []
+        prev = None
+        for curr in ordered_list:
+            if prev is not None and prev[-1] == 'ents' and curr[-1] == 'rels' and prev[0] >= curr[0]:
+                prev = curr
+                continue
+            cleaned_list.append(curr)
+            prev = curr
+        return cleaned_list
 
 
     def find_triple(self, ent_rel_list):
@@ -0,0 +1,53 @@
+"""
+Text normaliser used by Parser.simplify, compiled once per process
+"""
+import re
+
+# Removed (with the space around them) since they do not help to build the KG
+STOPWORDS = ['a', 'the', 'he', 'she', 'we', 'they', 'this', 'that', 'these', 'those']
+
+class Normaliser(object):
+    '''
+    Same output as the original chain of replacements: lowercase, remove texts within
+    brackets, remove '=' sub-headings, remove '\n' and '=', collapse up to 6 spaces
+    after each period into 1, replace ' <stopword> ' by ' ' for each stopword in turn.
+    The regexes are compiled once, the 4 period replacements are a single regex and
+    '\n' and '=' are removed by a single str.translate on ASCII text (on other text it
+    takes a much slower path than 2 str.replace, which are kept there).
+    The stopwords stay 1 str.replace each: adjacent stopwords share their space, so
+    an exact single-regex version needs a Python callback per match, which measured
+    slower than the C-level replacements (see benchmarks/normaliser.py).
+    '''
+    def __init__(self, stopwords=STOPWORDS):
+        self.brackets = re.compile(r" [\(\[].*?[\)\]]")
+        self.headings = re.compile(r"=.*? =")
+        # k spaces after a period: the original removed 3, then 2, then 1 of them
+        # (as long as there were enough), i.e. min(k, 6), then added 1 back
+        self.periods = re.compile(r"\. {0,6}")
+        self.removed = str.maketrans('', '', '\n=')
+        self.stopwords = [' ' + word + ' ' for word in stopwords]
+
+    def __call__(self, text):
+        # lower() first: removing text changes the context of the greek final sigma
+        text = text.lower()
+        text = self.brackets.sub("", text)
+        text = self.headings.sub("", text)
+        if text.isascii():
+            text = text.translate(self.removed)
+        else:
+            text = text.replace('\n', '').replace('=', '')
+        text = self.periods.sub(". ", text)
+        for stopword in self.stopwords:
+            text = text.replace(stopword, ' ')
+        return text
+
+_normaliser = None
+
+def get_normaliser():
+    """
+    Return the process-wide Normaliser, compiling it on first use
+    """
+    global _normaliser
+    if _normaliser is None:
+        _normaliser = Normaliser()
+    return _normaliser
@@ -0,0 +1,184 @@
+"""
+Bounded caches for parse results: in-process (LRUCache) and on disk (DocCache)
+"""
+import gzip
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Parsed documents are cached in DOC_CACHE_DIR, at most DOC_CACHE_MAX_MB in total (0 disables it)
+DOC_CACHE_DIR = os.environ.get("NLPQUERY_DOC_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "content", "doc_cache"))
+DOC_CACHE_MAX_MB = int(os.environ.get("NLPQUERY_DOC_CACHE_MAX_MB", 256))
+
+class LRUCache(object):
+    '''
+    A thread-safe Least-Recently-Used cache holding at most maxsize entries.
+    It keeps hit/miss/eviction counters so we can check how well it works.
+    '''
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.data), 'maxsize': self.maxsize, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+class DocCache(object):
+    '''
+    Disk cache of parsed documents: for each key (see Parser.doc_key) the triples found
+    in every sentence, as a gzipped json file. Files are shared by all processes.
+    Least-Recently-Used files are deleted once the cache is over max_bytes
+    (a file's mtime is its last use).
+    '''
+    def __init__(self, directory=DOC_CACHE_DIR, max_bytes=DOC_CACHE_MAX_MB << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json.gz")
+
+    def get(self, key):
+        """
+        Return the list of triples of each sentence of the document, None if not cached
+        """
+        path = self.path(key)
+        try:
+            with gzip.open(path, 'rt', encoding="utf-8") as f:
+                packed = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return self.unpack(packed)
+
+    def put(self, key, sent_triples_ls):
+        if self.max_bytes <= 0:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # written aside then renamed, readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding="utf-8") as f:
+                json.dump(self.pack(sent_triples_ls), f, separators=(',', ':'))
+            os.replace(tmp, self.path(key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used files until the cache fits in max_bytes
+        """
+        files = []
+        total = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".json.gz"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # evicted by another process
+                pass
+            total -= size
+            with self.lock:
+                self.evictions += 1
+
+    @staticmethod
+    def pack(sent_triples_ls):
+        """
+        Compact form: every distinct term once, the triples as 3 indexes into the terms,
+        and the number of triples of each sentence
+        """
+        terms = {}
+        flat = []
+        counts = []
+        for sent_triples in sent_triples_ls:
+            counts.append(len(sent_triples))
+            for triple in sent_triples:
+                for term in triple:
+                    flat.append(terms.setdefault(term, len(terms)))
+        return {'terms': list(terms), 'triples': flat, 'counts': counts}
+
+    @staticmethod
+    def unpack(packed):
+        terms = packed['terms']
+        flat = packed['triples']
+        sent_triples_ls = []
+        i = 0
+        for count in packed['counts']:
+            sent_triples_ls.append([(terms[flat[j]], terms[flat[j + 1]], terms[flat[j + 2]])
+                for j in range(i, i + 3 * count, 3)])
+            i += 3 * count
+        return sent_triples_ls
+
+    def stats(self):
+        with self.lock:
+            return {'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
+
+_doc_cache = None
+_doc_cache_lock = threading.Lock()
+
+def get_doc_cache():
+    """
+    Return the process-wide DocCache, None if it is disabled (NLPQUERY_DOC_CACHE_MAX_MB=0)
+    """
+    global _doc_cache
+    if DOC_CACHE_MAX_MB <= 0:
+        return None
+    if _doc_cache is None:
+        with _doc_cache_lock:
+            if _doc_cache is None:
+                _doc_cache = DocCache()
+    return _doc_cache
@@ -0,0 +1,188 @@
+"""
+Parsing service: a pool of processes owning the Pipeline instances, serving
+questionParse and docParse to the web workers over a local socket.
+Web workers then only need a RemotePipeline (no spaCy model), so their memory no
+longer grows with the model and their number can be scaled on its own.
+Start it with: python manage.py parse_service
+and point the web workers at it with NLPQUERY_PARSE_SERVICE=<host>:<port>
+Both sides must share the secret NLPQUERY_PARSE_SERVICE_KEY: requests and replies
+are pickled, so anyone able to connect could run code in the service.
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Listener, Client
+from .CustomPipeline import Pipeline
+from .KeywordsParser import Parser
+
+DEFAULT_ADDRESS = "127.0.0.1:6010"
+# Shared secret of the service and its clients (multiprocessing.connection authentication),
+# no default: neither side starts without it (see get_authkey)
+AUTHKEY = os.environ.get("NLPQUERY_PARSE_SERVICE_KEY")
+# Seconds the service waits for a worker process to answer a request before replying
+# with an error, clients wait REPLY_MARGIN more for that reply
+REQUEST_TIMEOUT = float(os.environ.get("NLPQUERY_PARSE_SERVICE_TIMEOUT", 300))
+REPLY_MARGIN = 5
+# Questions arriving within BATCH_WAIT seconds of each other are sent to a worker
+# process together, at most MAX_BATCH at a time
+BATCH_WAIT = 0.005
+MAX_BATCH = 32
+
+class ParseServiceError(Exception):
+    pass
+
+def get_authkey():
+    """
+    AUTHKEY as bytes, raise ParseServiceError if it is not set
+    """
+    if not AUTHKEY:
+        raise ParseServiceError("NLPQUERY_PARSE_SERVICE_KEY must be set to a shared secret "
+            "to run or use the parsing service")
+    return AUTHKEY.encode("utf-8")
+
+def parse_address(address):
+    """
+    '<host>:<port>' -> (host, port)
+    """
+    host, _, port = address.rpartition(':')
+    return (host or "127.0.0.1", int(port))
+
+# Pipeline of the current worker process
+_worker_pipe = None
+
+def _init_worker():
+    global _worker_pipe
+    if _worker_pipe is None:
+        _worker_pipe = Pipeline()
+
+def _parse_questions(texts):
+    return [Parser(text, _worker_pipe).questionParse() for text in texts]
+
+def _parse_chunks(chunks, batch_size):
+    return Parser("", _worker_pipe).parse_chunks(chunks, batch_size)
+
+class ParseService(object):
+    def __init__(self, address=DEFAULT_ADDRESS, processes=2):
+        """
+        address is '<host>:<port>' to listen on, processes the number of worker
+        processes (each with its own Pipeline)
+        """
+        self.address = parse_address(address)
+        self.processes = processes
+        self.questions = queue.Queue()
+
+    def serve_forever(self):
+        global _worker_pipe
+        authkey = get_authkey()
+        # Load the pipeline (building the cached artifact if needed) once here, forked
+        # workers then start with it already loaded and share its memory pages
+        _worker_pipe = Pipeline()
+        self.version = _worker_pipe.version
+        self.pool = multiprocessing.Pool(self.processes, initializer=_init_worker)
+        threading.Thread(target=self.batch_questions, name="parse-service-batcher", daemon=True).start()
+        with Listener(self.address, backlog=64, authkey=authkey) as listener:
+            print(f"Parse service listening on {self.address[0]}:{self.address[1]} "
+                  f"with {self.processes} processes")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+                    print(f"Parse service: rejected connection ({e})")
+                    continue
+                threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def serve(self, conn):
+        """
+        Answer the requests of one client connection until it is closed.
+        Requests are (op, *args) tuples, replies ('ok', result) or ('error', message),
+        also an error if the worker processes take more than REQUEST_TIMEOUT seconds.
+        """
+        with conn:
+            while True:
+                try:
+                    op, *args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if op == 'question':
+                        future = Future()
+                        self.questions.put((args[0], future))
+                        result = future.result(timeout=REQUEST_TIMEOUT)
+                    elif op == 'chunks':
+                        result = self.pool.apply_async(_parse_chunks, args).get(timeout=REQUEST_TIMEOUT)
+                    elif op == 'version':
+                        result = self.version
+                    else:
+                        raise ParseServiceError(f"Unknown request {op!r}")
+                    conn.send(('ok', result))
+                except (concurrent.futures.TimeoutError, multiprocessing.TimeoutError):
+                    conn.send(('error', f"Request {op!r} timed out after {REQUEST_TIMEOUT:g}s"))
+                except Exception as e:
+                    conn.send(('error', f"{type(e).__name__}: {e}"))
+
+    def batch_questions(self):
+        """
+        Group the questions of all connections into batches for the worker processes
+        """
+        while True:
+            batch = [self.questions.get()]
+            deadline = time.monotonic() + BATCH_WAIT
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self.questions.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            futures = [future for _, future in batch]
+            self.pool.apply_async(_parse_questions, ([text for text, _ in batch],),
+                callback=lambda results, futures=futures: [f.set_result(r) for f, r in zip(futures, results)],
+                error_callback=lambda e, futures=futures: [f.set_exception(e) for f in futures])
+
+class RemotePipeline(object):
+    """
+    Stand-in for Pipeline in the web workers when the parsing service is used:
+    Parser sends its work to the service instead of running spaCy itself.
+    Each thread gets its own connection.
+    """
+    remote = True
+    nlp = None
+
+    def __init__(self, address=DEFAULT_ADDRESS):
+        self.authkey = get_authkey()
+        self.address = parse_address(address)
+        self.local = threading.local()
+        self._version = None
+
+    def request(self, op, *args):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = Client(self.address, authkey=self.authkey)
+        try:
+            conn.send((op,) + args)
+            if not conn.poll(REQUEST_TIMEOUT + REPLY_MARGIN):
+                raise ParseServiceError(f"No reply from the parsing service to {op!r}")
+            status, result = conn.recv()
+        except (EOFError, OSError, ParseServiceError):
+            # service restarted, or a late reply would come in the place of the next one:
+            # reconnect on the next request
+            self.local.conn = None
+            conn.close()
+            raise
+        if status != 'ok':
+            raise ParseServiceError(result)
+        return result
+
+    @property
+    def version(self):
+        if self._version is None:
+            self._version = self.request('version')
+        return self._version
+
+    def questionParse(self, text):
+        return self.request('question', text)
+
+    def parse_chunks(self, chunks, batch_size):
+        return self.request('chunks', chunks, batch_size)
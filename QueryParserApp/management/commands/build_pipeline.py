@@ -0,0 +1,27 @@
+"""
+Build the custom spaCy pipeline and cache it to disk (see CustomPipeline.ARTIFACT_DIR)
+Usage: python manage.py build_pipeline [--force] [--prune]
+"""
+import os
+import shutil
+from django.core.management.base import BaseCommand
+from QueryParserApp.CustomPipeline import Pipeline, ARTIFACT_DIR
+
+class Command(BaseCommand):
+    help = "Build the custom spaCy pipeline and save it as the cached artifact loaded at startup"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+            help="Rebuild even if an artifact for the current keyword files already exists")
+        parser.add_argument('--prune', action='store_true',
+            help="Delete the artifacts of other pipeline versions (once no process uses them)")
+
+    def handle(self, *args, **options):
+        if options['force'] and os.path.isdir(ARTIFACT_DIR):
+            shutil.rmtree(ARTIFACT_DIR)
+        custom_pipe = Pipeline()
+        path = os.path.join(ARTIFACT_DIR, custom_pipe.version)
+        self.stdout.write(self.style.SUCCESS(f"Pipeline {custom_pipe.version} ready at {path}"))
+        if options['prune']:
+            for name in custom_pipe.prune_artifacts():
+                self.stdout.write(f"Deleted the artifact of pipeline {name}")
@@ -0,0 +1,20 @@
+"""
+Run the parsing service used by the web workers when NLPQUERY_PARSE_SERVICE is set
+Usage: NLPQUERY_PARSE_SERVICE_KEY=<secret> python manage.py parse_service [--address HOST:PORT] [--processes N]
+The web workers need the same NLPQUERY_PARSE_SERVICE_KEY, neither side runs without it.
+"""
+import os
+from django.core.management.base import BaseCommand
+from QueryParserApp.ParseService import ParseService, DEFAULT_ADDRESS
+
+class Command(BaseCommand):
+    help = "Serve questionParse/docParse to the web workers from a pool of pipeline processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--address', default=os.environ.get("NLPQUERY_PARSE_SERVICE", DEFAULT_ADDRESS),
+            help="<host>:<port> to listen on (default: NLPQUERY_PARSE_SERVICE or %(default)s)")
+        parser.add_argument('--processes', type=int, default=2,
+            help="Number of worker processes, each owning a Pipeline")
+
+    def handle(self, *args, **options):
+        ParseService(options['address'], options['processes']).serve_forever()
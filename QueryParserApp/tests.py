@@ -0,0 +1,115 @@
+import glob
+import os
+import random
+import re
+from django.conf import settings
+from django.test import SimpleTestCase
+from .KeywordsParser import text_batches, SAFE_CUT, MAX_BATCH_TEXT, READ_SIZE
+from .Normaliser import Normaliser, STOPWORDS, get_normaliser
+
+INPUT_FILES = os.path.join("Example_inputs", "*.txt")
+# Random texts are made of these pieces: stopwords, periods and spaces, brackets,
+# '=' headings, newlines, and non-ASCII text (final sigma, letters longer once lowercased)
+PIECES = STOPWORDS + ['The', 'THESE', 'an', 'other', 'stock', 'share', 'x', '1.5', '.', ',',
+    ' ', '  ', '   ', '\n', '=', '==', '(', ')', '[', ']', '(note)', '[1]', 'ΑΣ', 'İ', 'é']
+GOLDEN_CASES = 2000
+
+def legacy_simplify(text):
+    # Original Parser.simplify, kept as the reference implementation
+    text = text.lower()
+    to_replace_with_space = [' a ', ' the ', ' he ', ' she ', ' we ', ' they ', ' this ', ' that ', ' these ', ' those ']
+    to_remove = ['\n', '=']
+    source = text
+    source = re.sub(r" [\(\[].*?[\)\]]", "", source)
+    source = re.sub(r"[=].*? [=]", "", source)
+    for dummy in to_remove:
+        source = source.replace(dummy, '')
+    n = 3
+    for i in range(n):
+        dummy = '.' + ' '*(n-i)
+        source = source.replace(dummy, '.')
+    source = source.replace('.', '. ')
+    for dummy in to_replace_with_space:
+        source = source.replace(dummy, ' ')
+    return source
+
+def random_text(rng, length):
+    return ''.join(rng.choice(PIECES) + rng.choice(['', ' ', ' ', ' ']) for _ in range(length))
+
+def golden_texts(base_dir, cases=GOLDEN_CASES, seed=0):
+    """
+    Return (input files, random texts): the texts of the Example_inputs files of the
+    project at base_dir and cases random texts of 1 to 40 PIECES
+    """
+    inputs = []
+    for path in sorted(glob.glob(os.path.join(base_dir, INPUT_FILES))):
+        with open(path, encoding="utf-8") as f:
+            inputs.append(f.read())
+    rng = random.Random(seed)
+    return inputs, [random_text(rng, rng.randint(1, 40)) for _ in range(cases)]
+
+def golden_mismatches(normalise, texts):
+    """
+    Return the texts for which normalise and legacy_simplify differ
+    """
+    return [text for text in texts if normalise(text) != legacy_simplify(text)]
+
+def stock_text():
+    with open(os.path.join(settings.BASE_DIR, "Example_inputs", "Stock.txt"), encoding="utf-8") as f:
+        return f.read()
+
+
+class NormaliserTests(SimpleTestCase):
+    '''
+    Golden check: the Normaliser must give the same text as the original Parser.simplify
+    (benchmarks/normaliser.py runs it on more random texts)
+    '''
+    def test_golden_texts(self):
+        inputs, random_texts = golden_texts(settings.BASE_DIR)
+        self.assertTrue(inputs)
+        failed = golden_mismatches(Normaliser(), inputs + random_texts)
+        self.assertEqual(failed, [], f"{len(failed)} of {len(inputs) + len(random_texts)} golden texts differ")
+
+
+class TextBatchesTests(SimpleTestCase):
+    '''
+    Simplifying the batches of text_batches one by one must give the same text as
+    simplifying the whole document
+    '''
+    def assertSimplifiedAlike(self, text, pieces, batch_size=None):
+        normalise = get_normaliser()
+        if batch_size is None:
+            batches = list(text_batches(pieces))
+        else:
+            batches = list(text_batches(pieces, batch_size))
+        self.assertEqual(''.join(batches), text)
+        self.assertEqual(''.join(normalise(batch) for batch in batches), normalise(text))
+        return batches
+
+    def test_large_document_without_safe_cut(self):
+        stock = stock_text()
+        # over MAX_BATCH_TEXT, and its lines end with a period: no SAFE_CUT anywhere
+        text = stock * (MAX_BATCH_TEXT // len(stock) + 2)
+        self.assertIsNone(SAFE_CUT.search(text))
+        for size in (READ_SIZE, READ_SIZE + 1, 99991):
+            batches = self.assertSimplifiedAlike(text, [text[i:i + size] for i in range(0, len(text), size)])
+            self.assertLess(max(len(batch) for batch in batches), MAX_BATCH_TEXT)
+
+    def test_single_line(self):
+        text = stock_text().replace('\n', ' ').replace('=', '') * 4
+        batches = self.assertSimplifiedAlike(text, [text[i:i + READ_SIZE] for i in range(0, len(text), READ_SIZE)])
+        self.assertGreater(len(batches), 1)
+
+    def test_random_cuts(self):
+        rng = random.Random(0)
+        tokens = ['th', 'e', 'a', 'the', 'ese', 'those', 'they', 'stock', 'Market', 'ΑΣ', '\n', '\r\n',
+            ' ', '  ', '.', ' (x', 'y)', ' [', '] ', '=', '= h =', '=\n']
+        for _ in range(3000):
+            text = ''.join(rng.choice(tokens) for _ in range(rng.randint(1, 80)))
+            pieces = []
+            i = 0
+            while i < len(text):
+                size = rng.randint(1, 9)
+                pieces.append(text[i:i + size])
+                i += size
+            self.assertSimplifiedAlike(text, pieces, rng.randint(1, 20))
@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Web.settings')
 
-application = get_asgi_application()
\ No newline at end of file
+application = get_asgi_application()
+
+# Build the spaCy pipeline in the background so the first question does not wait for it
+if settings.NLPQUERY_WARM_UP:
+    from QueryParserApp.CustomPipeline import warm_up
+    warm_up()
@@ -0,0 +1,198 @@
+"""
+Stage timing of requests and background jobs
+- stage(name, **sizes): context manager/decorator recording the wall and CPU time
+  of a step (and the sizes it worked on) into the current recording and the histograms
+- StageTimingMiddleware: records every request, adds a Server-Timing header (for the
+  clients allowed to see the metrics) and logs a line per request; with NLPQUERY_PROFILE_SLOW_MS set, also profiles requests and
+  keeps the cProfile stats of those slower than that
+- metrics: json view of the histograms (see metrics_allowed)
+stage() works without Django (e.g. in benchmarks or the parsing service).
+"""
+import contextvars
+import cProfile
+import functools
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger("nlpquery.timing")
+
+# Upper bounds (milliseconds) of the histogram buckets, the last one is for anything slower
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+# Stage totals of the request/job being recorded in this context (None if there is none)
+_recording = contextvars.ContextVar("nlpquery_recording", default=None)
+
+class Histogram(object):
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.sum_cpu_ms = 0.0
+
+    def add(self, wall_ms, cpu_ms):
+        self.counts[bisect_left(BUCKETS_MS, wall_ms)] += 1
+        self.count += 1
+        self.sum_ms += wall_ms
+        self.sum_cpu_ms += cpu_ms
+
+    def to_dict(self):
+        buckets = {str(bound): count for bound, count in zip(BUCKETS_MS, self.counts)}
+        buckets['inf'] = self.counts[-1]
+        return {'count': self.count, 'sum_ms': round(self.sum_ms, 3),
+            'sum_cpu_ms': round(self.sum_cpu_ms, 3), 'buckets_ms': buckets}
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+def observe(name, wall_ms, cpu_ms):
+    with _histograms_lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.add(wall_ms, cpu_ms)
+
+def histograms():
+    with _histograms_lock:
+        return {name: histogram.to_dict() for name, histogram in sorted(_histograms.items())}
+
+class stage(object):
+    '''
+    Time a step, as a context manager:
+        with stage('doc.parse', chunks=len(chunk_batch)) as s:
+            ...
+            s.add(sentences=n)
+    or as a decorator: @stage('kg.find_triples')
+    Sizes are summed over the repeated calls of a stage within a recording.
+    '''
+    def __init__(self, name, **sizes):
+        self.name = name
+        self.sizes = sizes
+
+    def add(self, **sizes):
+        self.sizes.update(sizes)
+
+    def __enter__(self):
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall_ms = (time.perf_counter() - self.start_wall) * 1000
+        cpu_ms = (time.thread_time() - self.start_cpu) * 1000
+        observe(self.name, wall_ms, cpu_ms)
+        recording = _recording.get()
+        if recording is not None:
+            totals = recording.setdefault(self.name, {'calls': 0, 'wall_ms': 0.0, 'cpu_ms': 0.0, 'sizes': {}})
+            totals['calls'] += 1
+            totals['wall_ms'] += wall_ms
+            totals['cpu_ms'] += cpu_ms
+            for key, value in self.sizes.items():
+                totals['sizes'][key] = totals['sizes'].get(key, 0) + value
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(self.name, **self.sizes):
+                return func(*args, **kwargs)
+        return wrapper
+
+@contextmanager
+def recording():
+    """
+    Record the stages run in this context (thread) until exit.
+    Yield the dict of stage name -> {'calls', 'wall_ms', 'cpu_ms', 'sizes'}
+    """
+    stages = {}
+    token = _recording.set(stages)
+    try:
+        yield stages
+    finally:
+        _recording.reset(token)
+
+def format_stages(stages):
+    """
+    One line summary of recorded stages: name=<wall>ms/<cpu>ms(<calls>x)[sizes]
+    """
+    parts = []
+    for name, totals in stages.items():
+        part = f"{name}={totals['wall_ms']:.1f}ms/{totals['cpu_ms']:.1f}ms"
+        if totals['calls'] > 1:
+            part += f"({totals['calls']}x)"
+        if totals['sizes']:
+            part += '[' + ','.join(f"{key}={value}" for key, value in totals['sizes'].items()) + ']'
+        parts.append(part)
+    return ' '.join(parts)
+
+def server_timing(stages, total_ms):
+    """
+    Server-Timing header value (shown by the browsers' developer tools)
+    """
+    entries = [f'{name};dur={totals["wall_ms"]:.1f}' for name, totals in stages.items()]
+    entries.append(f"total;dur={total_ms:.1f}")
+    return ', '.join(entries)
+
+def metrics_allowed(request):
+    """
+    Whether the timings may be shown to the client of request: in DEBUG, to staff users,
+    or to anyone when NLPQUERY_METRICS_PUBLIC is set (the client address is no proof of
+    anything behind a proxy)
+    """
+    from django.conf import settings
+    user = getattr(request, 'user', None)
+    return (settings.DEBUG or getattr(settings, 'NLPQUERY_METRICS_PUBLIC', False)
+        or (user is not None and user.is_staff))
+
+class StageTimingMiddleware(object):
+    def __init__(self, get_response):
+        from django.conf import settings
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, 'NLPQUERY_PROFILE_SLOW_MS', None)
+        self.profile_dir = getattr(settings, 'NLPQUERY_PROFILE_DIR', None)
+
+    def __call__(self, request):
+        profiler = cProfile.Profile() if self.slow_ms is not None else None
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        with recording() as stages:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        total_ms = (time.perf_counter() - start_wall) * 1000
+        cpu_ms = (time.thread_time() - start_cpu) * 1000
+        observe('request', total_ms, cpu_ms)
+
+        # request.user is set by the AuthenticationMiddleware by now
+        if metrics_allowed(request):
+            response['Server-Timing'] = server_timing(stages, total_ms)
+        logger.info("%s %s %s %.1fms/%.1fms %s", request.method, request.path, response.status_code,
+            total_ms, cpu_ms, format_stages(stages))
+        if profiler is not None and total_ms >= self.slow_ms:
+            self.save_profile(profiler, request, total_ms)
+        return response
+
+    def save_profile(self, profiler, request, total_ms):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = request.path.strip('/').replace('/', '_') or 'home'
+        path = os.path.join(self.profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{total_ms:.0f}ms.prof")
+        profiler.dump_stats(path)
+        logger.warning("slow request %s %s (%.0fms), profile saved to %s", request.method, request.path,
+            total_ms, path)
+
+def metrics(request):
+    """
+    Histograms of the wall time of every stage (and of whole requests) since this
+    process started, as json. Only answered when metrics_allowed.
+    """
+    from django.http import JsonResponse
+    if not metrics_allowed(request):
+        return JsonResponse({'error': "Forbidden"}, status=403)
+    return JsonResponse({'pid': os.getpid(), 'stages': histograms()})
@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so that its timings cover the whole request
+    'Web.instrumentation.StageTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,11 +83,50 @@ WSGI_APPLICATION = 'Web.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # wait for concurrent writers (e.g. KGsave) instead of failing with "database is locked"
+        'OPTIONS': {'timeout': 20},
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered KGs of the ResultsPage (see NLPQueryApp.views.draw_graph).
+    # Use 'django.core.cache.backends.filebased.FileBasedCache' with a 'LOCATION'
+    # folder to share them between worker processes and keep them across restarts.
+    'kg_graphs': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'kg-graphs',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 500},
+    },
+    # Triples parsed from each session's document (see NLPQueryApp.results_store).
+    # Must be shared by all worker processes, hence file-based.
+    'nlpquery_results': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache', 'results'),
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+    # State of the ingestion jobs (see NLPQueryApp.jobs), a few hundred bytes each.
+    # Apart from the triples so that culling them never loses a running job.
+    'nlpquery_jobs': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, '.cache', 'jobs'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# Sessions only hold a few small fields (see NLPQueryApp.results_store), keep them in a
+# signed cookie so they need no database table and work across worker processes
+SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -125,4 +166,60 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [
     STATIC_DIR,
-]
\ No newline at end of file
+]
+
+
+# NLPQueryBot
+
+# Debugging only: write the triples parsed from users' document to a "private_db"
+# json file in the CWD and read them back, instead of indexing them in memory.
+NLPQUERY_PRIVATE_DB = False
+
+# Number of processes nlp.pipe uses to parse an uploaded document (1 = in the request process)
+NLPQUERY_PARSE_PROCESSES = 1
+
+# Build the custom spaCy pipeline in a background thread as soon as the WSGI/ASGI
+# application is loaded. Otherwise it is built by the first request that needs it.
+NLPQUERY_WARM_UP = True
+
+# How the KG is rendered on the ResultsPage: 'json' sends the graphs' nodes and edges to be
+# drawn in the browser (no matplotlib work per request), 'mpld3' plots them server-side
+NLPQUERY_RENDER_MODE = 'json'
+
+# Where our DB of triples is read from and saved to: 'sqlite' is the Triple table of the
+# database above (filled from data.json by `python manage.py migrate`, see also the
+# import_kg_json command), 'json' is NLPQueryApp/database/data.json itself.
+# Either way `python manage.py build_kg_snapshot` writes a snapshot that the workers
+# memory-map instead of loading the triples, until triples are saved to the DB.
+NLPQUERY_KG_BACKEND = 'sqlite'
+
+# Seconds the parsed triples of a session's document are kept after its last question
+NLPQUERY_RESULTS_TTL = 2 * 60 * 60
+
+# Uploaded documents are parsed in the background by this many threads per worker process
+NLPQUERY_INGEST_WORKERS = 2
+
+# A parsing job whose progress has not changed for this many seconds is reported as failed
+NLPQUERY_JOB_STALE = 10 * 60
+
+# Stage timings: one log line per request/parsing job (see Web.instrumentation)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'nlpquery.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# When set (milliseconds), every request is run under cProfile and the stats of those
+# slower than this are saved to NLPQUERY_PROFILE_DIR (open them with pstats or snakeviz)
+NLPQUERY_PROFILE_SLOW_MS = None
+NLPQUERY_PROFILE_DIR = os.path.join(BASE_DIR, '.cache', 'profiles')
+
+# /metrics (stage histograms) and the Server-Timing header are served in DEBUG and to staff
+# users. Set this to serve them to anyone, e.g. when only the monitoring network can reach
+# the web workers.
+NLPQUERY_METRICS_PUBLIC = False
@@ -18,9 +18,11 @@ from django.urls import path, include
 from django.views.generic import RedirectView
 from django.conf.urls import url
 from django.conf.urls.static import static
+from .instrumentation import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('NLPQueryApp.urls')),
+    path('metrics', metrics, name="metrics"),
     url(r'^favicon\.ico$',RedirectView.as_view(url='/static/images/favicon.ico')),
 ]
\ No newline at end of file
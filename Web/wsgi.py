@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Web.settings')
 
-application = get_wsgi_application()
\ No newline at end of file
+application = get_wsgi_application()
+
+# Build the spaCy pipeline in the background so the first question does not wait for it
+if settings.NLPQUERY_WARM_UP:
+    from QueryParserApp.CustomPipeline import warm_up
+    warm_up()
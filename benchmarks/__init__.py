@@ -0,0 +1,4 @@
+"""
+Offline benchmarks for NLPQueryBot, run from the repository root, e.g.
+    python -m benchmarks.profiles
+"""
@@ -0,0 +1,88 @@
+"""
+Check the CompactStore against the TripleStore (same find_triples results for every
+pair of terms of the questions' entities over data.json, and random pairs), then
+compare their memory per triple and find_triples time on N synthetic triples.
+Usage: python -m benchmarks.compact_store [--triples N] [--queries N]
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from KnowledgeGraphApp.KGbuild import KnowledgeGraph
+from KnowledgeGraphApp.TripleStore import TripleStore
+from KnowledgeGraphApp.CompactStore import CompactStore
+
+DB_FILE = "NLPQueryApp/database/data.json"
+SUBTOPIC = "finance"
+
+def synthetic_triples(rng, n):
+    # a long tail of terms and 1 in 10 from a few hundred very common ones
+    n_terms = max(10, n // 4)
+    n_rels = max(10, n // 50)
+    def term():
+        if rng.random() < 0.1:
+            return f"term{rng.randrange(300)}"
+        return f"term{rng.randrange(n_terms)}"
+    return [(term(), f"rel{rng.randrange(n_rels)}", term()) for _ in range(n)]
+
+def build(cls, triples_ls):
+    """
+    Return the store and the memory allocated to build it (bytes)
+    """
+    tracemalloc.start()
+    store = cls.from_triples(triples_ls)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return store, size
+
+def check(KG, stores, queries):
+    """
+    Golden check: return the queries for which the stores' find_triples differ
+    """
+    return [query for query in queries
+        if len({json.dumps(KG.find_triples(store, *query)) for store in stores}) > 1]
+
+def time_queries(KG, store, queries):
+    start = time.perf_counter()
+    for query in queries:
+        KG.find_triples(store, *query)
+    return (time.perf_counter() - start) / len(queries)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--triples", type=int, default=1000000, help="synthetic triples to load")
+    arg_parser.add_argument("--queries", type=int, default=200, help="find_triples calls to time")
+    args = arg_parser.parse_args()
+    rng = random.Random(0)
+    KG = KnowledgeGraph(DB_FILE, SUBTOPIC, [])
+
+    with open(DB_FILE) as f:
+        data = json.load(f)
+    stores = (TripleStore.from_data(data, SUBTOPIC), CompactStore.from_data(data, SUBTOPIC))
+    subjects = [subj for subj, _, _ in stores[0].triples]
+    rels = [rel for _, rels_ls, _ in stores[0].triples for rel in rels_ls]
+    queries = [([rng.choice(subjects), rng.choice(subjects + ['unknown'])], {rng.choice(rels)})
+        for _ in range(args.queries)]
+    queries += [([subj, obj], set(rels_ls)) for subj, rels_ls, obj in stores[0].triples[:args.queries]]
+    failed = check(KG, stores, queries)
+    print(f"golden check: {len(queries)} queries over {DB_FILE}, {len(failed)} mismatches")
+
+    triples_ls = synthetic_triples(rng, args.triples)
+    print(f"{args.triples} synthetic triples")
+    print(f"{'store':<14} {'build s':>8} {'bytes/triple':>13} {'find_triples ms':>16}")
+    for cls in (TripleStore, CompactStore):
+        start = time.perf_counter()
+        store, size = build(cls, triples_ls)
+        build_s = time.perf_counter() - start
+        queries = [([rng.choice(triples_ls)[0], rng.choice(triples_ls)[2]], {rng.choice(triples_ls)[1]})
+            for _ in range(args.queries)]
+        query_ms = time_queries(KG, store, queries) * 1000
+        print(f"{cls.__name__:<14} {build_s:>8.2f} {size / len(triples_ls):>13.1f} {query_ms:>16.3f}")
+        if cls is CompactStore:
+            print(f"  of which columns: {store.nbytes() / len(triples_ls):.1f} bytes/triple, "
+                  f"{len(store.terms)} terms")
+        del store
+
+if __name__ == '__main__':
+    main()
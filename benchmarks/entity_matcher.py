@@ -0,0 +1,85 @@
+"""
+Time the simple_keynouns overlap check (KeytermMatcher.add_entities) against the
+original entity-by-entity string containment check, on Example_inputs/Stock.txt.
+Usage: python -m benchmarks.entity_matcher [--repeat N] [--scale N]
+"""
+import argparse
+import time
+from spacy.tokens import Span
+from QueryParserApp.CustomPipeline import Pipeline
+from QueryParserApp.KeywordsParser import Parser
+
+DOC_FILE = "Example_inputs/Stock.txt"
+
+def legacy_simple_entities(matcher, doc):
+    # Original SimpleEntityMatcher.__call__, kept as the reference implementation
+    matches = matcher(doc)
+    spans = []
+    for label, start, end in matches:
+        span = Span(doc, start, end, label=label)
+        duplicate = False
+        for ent in doc.ents:
+            if (str(span) in str(ent) and ent.start <= span.end <= ent.end):
+                duplicate = True
+        if duplicate == False:
+            spans.append(span)
+    doc.ents = list(doc.ents) + spans
+    return doc
+
+def run(component, docs, repeat):
+    """
+    Apply component to every doc repeat times, restoring the doc's entities in between.
+    Return (seconds, failures, entities of the last run).
+    """
+    saved = [list(doc.ents) for doc in docs]
+    failures = 0
+    results = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        failures = 0
+        results = []
+        for doc, ents in zip(docs, saved):
+            doc.ents = ents
+            try:
+                component(doc)
+            except ValueError:
+                # conflicting (overlapping) doc.ents
+                failures += 1
+            results.append([(ent.start, ent.end, ent.label_) for ent in doc.ents])
+    elapsed = time.perf_counter() - start
+    for doc, ents in zip(docs, saved):
+        doc.ents = ents
+    return elapsed, failures, results
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--repeat", type=int, default=10)
+    arg_parser.add_argument("--scale", type=int, default=1, help="copies of Stock.txt to parse")
+    args = arg_parser.parse_args()
+
+    custom_pipe = Pipeline()
+    with open(DOC_FILE) as f:
+        text = Parser("", custom_pipe).simplify(f.read()) * args.scale
+    # docs as they reach simple_keynouns: everything before it in the pipeline has run
+    chunks = list(Parser("", custom_pipe).split_chunks(text))
+    names = custom_pipe.nlp.pipe_names
+    with custom_pipe.nlp.disable_pipes(*names[names.index('simple_keynouns'):]):
+        docs = list(custom_pipe.nlp.pipe(chunks))
+    simple_matcher = custom_pipe.nlp.get_pipe('simple_keynouns')
+
+    n_ents = sum(len(doc.ents) for doc in docs)
+    n_matches = sum(len(simple_matcher.matcher(doc)) for doc in docs)
+    legacy_s, legacy_fail, legacy_ents = run(
+        lambda doc: legacy_simple_entities(simple_matcher.matcher, doc), docs, args.repeat)
+    new_s, new_fail, new_ents = run(simple_matcher.add_entities, docs, args.repeat)
+    same = sum(1 for a, b in zip(legacy_ents, new_ents) if a == b)
+
+    print(f"{len(docs)} chunks, {sum(len(doc) for doc in docs)} tokens, "
+          f"{n_ents} existing ents, {n_matches} simple keyterm matches")
+    print(f"{'check':<10} {'ms/run':>10} {'failed docs':>12}")
+    print(f"{'legacy':<10} {legacy_s / args.repeat * 1000:>10.2f} {legacy_fail:>12}")
+    print(f"{'coverage':<10} {new_s / args.repeat * 1000:>10.2f} {new_fail:>12}")
+    print(f"speedup {legacy_s / new_s:.1f}x, identical entities in {same}/{len(docs)} chunks")
+
+if __name__ == '__main__':
+    main()
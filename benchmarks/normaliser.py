@@ -0,0 +1,46 @@
+"""
+Check the Normaliser (Parser.simplify) against the original chain of replacements,
+on the Example_inputs files and random texts made of the tricky pieces (stopwords,
+periods and spaces, brackets, '=' headings, newlines, see QueryParserApp.tests),
+and time both in MB/s.
+Usage: python -m benchmarks.normaliser [--cases N] [--scale N]
+"""
+import argparse
+import time
+from QueryParserApp.Normaliser import Normaliser
+from QueryParserApp.tests import legacy_simplify, golden_texts, golden_mismatches
+
+def throughput(func, text, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - start)
+    return len(text.encode("utf-8")) / best / 1e6
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--cases", type=int, default=20000, help="random texts to check")
+    arg_parser.add_argument("--scale", type=int, default=100, help="copies of the inputs to time")
+    args = arg_parser.parse_args()
+    normalise = Normaliser()
+
+    # the same texts as NormaliserTests, with more random ones
+    inputs, random_texts = golden_texts(".", args.cases)
+    failed = golden_mismatches(normalise, inputs + random_texts)
+    print(f"golden check: {len(inputs)} input files + {len(random_texts)} random texts, "
+          f"{len(failed)} mismatches")
+    for text in failed[:5]:
+        print(f"  {text!r}\n    legacy:     {legacy_simplify(text)!r}\n    normaliser: {normalise(text)!r}")
+
+    text = ''.join(inputs) * args.scale
+    legacy = throughput(legacy_simplify, text)
+    new = throughput(normalise, text)
+    print(f"{len(text.encode('utf-8')) / 1e6:.1f} MB of text")
+    print(f"{'simplify':<12} {'MB/s':>8}")
+    print(f"{'legacy':<12} {legacy:>8.1f}")
+    print(f"{'normaliser':<12} {new:>8.1f}")
+    print(f"speedup {new / legacy:.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Throughput of each task profile of the custom Pipeline (see CustomPipeline.PROFILES)
+against the full pipeline on the same input:
+- 'question' on the sample questions (it needs every component)
+- 'sentences' (parser only) on the chunks of the simplified sample document
+- 'triples' (Pipeline.annotate) on the Simple sentences, reusing their parse,
+  against parsing the sentence strings again with the full pipeline
+Usage: python -m benchmarks.profiles [--repeat N]
+"""
+import argparse
+import time
+from QueryParserApp.CustomPipeline import Pipeline, PROFILES
+from QueryParserApp.KeywordsParser import Parser
+
+DOC_FILE = "Example_inputs/Stock.txt"
+QUS_FILE = "Example_inputs/Qus_ls.txt"
+
+def load_questions():
+    with open(QUS_FILE) as f:
+        return [line.strip().strip('"').lower() for line in f if line.strip()]
+
+def load_chunks(parser):
+    """
+    Return the simplified sample document split into chunks, as docParse does
+    """
+    with open(DOC_FILE) as f:
+        return list(parser.split_chunks(parser.simplify(f.read())))
+
+def throughput(func, n_texts, n_words, repeat):
+    """
+    Call func repeat times, return (texts per second, words per second)
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = time.perf_counter() - start
+    return n_texts * repeat / elapsed, n_words * repeat / elapsed
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--repeat", type=int, default=20)
+    args = arg_parser.parse_args()
+
+    custom_pipe = Pipeline()
+    nlp = custom_pipe.nlp
+    parser = Parser("", custom_pipe)
+    questions = load_questions()
+    chunks = load_chunks(parser)
+    sents = [sent for doc in nlp.pipe(chunks, disable=custom_pipe.disabled('sentences')) for sent in doc.sents]
+    simple = [sent for sent in sents if parser.is_simple(sent)]
+    simple_texts = [sent.string.strip() for sent in simple]
+
+    full = tuple(nlp.pipe_names)
+    setups = [
+        ('question', 'questions', questions,
+            lambda: list(nlp.pipe(questions, disable=custom_pipe.disabled('question'))), PROFILES['question']),
+        ('full', 'chunks', chunks, lambda: list(nlp.pipe(chunks)), full),
+        ('sentences', 'chunks', chunks,
+            lambda: list(nlp.pipe(chunks, disable=custom_pipe.disabled('sentences'))), PROFILES['sentences']),
+        ('full', 'simple', simple_texts, lambda: list(nlp.pipe(simple_texts)), full),
+        ('triples', 'simple', simple_texts,
+            lambda: list(custom_pipe.annotate([sent.as_doc() for sent in simple], 'triples')), PROFILES['triples']),
+    ]
+    print(f"{'profile':<10} {'input':<10} {'texts/s':>10} {'words/s':>10}  components")
+    for task, name, texts, func, components in setups:
+        n_words = sum(len(text.split()) for text in texts)
+        texts_s, words_s = throughput(func, len(texts), n_words, args.repeat)
+        print(f"{task:<10} {name:<10} {texts_s:>10.1f} {words_s:>10.1f}  {', '.join(components)}")
+
+if __name__ == '__main__':
+    main()
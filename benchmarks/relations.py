@@ -0,0 +1,208 @@
+"""
+Check and time the relation dedup (RelationMatcher.remove_duplicates) and the
+entity/relation ordering (Parser.order_entity_relation) against the original
+nested-loop versions, on random matcher-like inputs and long synthetic sentences.
+The dedup is checked on distinct lemmas (same output as the original) and on
+lemmas shared between matches, e.g. "rise" and "rise to" (the output of the
+token-coverage rule, differing from the original only in the documented ways).
+Exits with status 1 if a check fails.
+Usage: python -m benchmarks.relations [--cases N] [--length N]
+"""
+import argparse
+import random
+import sys
+import time
+from QueryParserApp.CustomPipeline import RelationMatcher
+from QueryParserApp.KeywordsParser import Parser
+
+WORDS = ['determine', 'buy', 'own', 'issue', 'trade', 'sell', 'hold', 'pay', 'rise', 'list']
+# lemmas that are substrings of each other, as in real sentences
+SHARED_WORDS = ['rise', 'arise', 'own', 'hold', 'sell']
+PARTICLES = ['by', 'in', 'on', 'to', 'for', 'of', 'with', 'able', 'high']
+
+def legacy_remove_duplicates(relations):
+    # Original get_relation dedup, kept as the reference implementation
+    for start, relation1 in relations:
+        if len(relation1.split()) != 1:
+            continue
+        else:
+            for _, relation2 in relations:
+                if len(relation2.split()) == 1:
+                    continue
+                if relation2.find(relation1) != -1:
+                    relations.remove((start, relation1))
+                    break
+    return relations
+
+def legacy_order_entity_relation(ent_list, relation_list):
+    # Original ordered_entity_relation, kept as the reference implementation
+    combined_list = ent_list + relation_list
+    ordered_list = sorted(combined_list, key=lambda x: x[0])
+    n = len(ordered_list)
+    remove_list = []
+    for i in range(n-1):
+        tuple1 = ordered_list[i]
+        tuple2 = ordered_list[i+1]
+        if tuple1[-1] == 'ents' and tuple2[-1] == 'rels':
+            if tuple1[0] >= tuple2[0]:
+                remove_list.append(tuple2)
+    for trash in remove_list:
+        ordered_list.remove(trash)
+    ordered_list = sorted(ordered_list, key=lambda x: x[0])
+    return ordered_list
+
+def random_spans(rng, n_anchors, sent_len, distinct=True):
+    """
+    Matches shaped like the ROOT/acl Matcher output: every anchor token matches alone
+    and followed by 0-3 optional tokens, sorted by (start, end).
+    With distinct, anchors use distinct lemmas (no lemma is a substring of another),
+    otherwise they are drawn from the few SHARED_WORDS, so e.g. "rise" alone at one
+    anchor and "rise to" or "arise to" at another are common.
+    """
+    starts = sorted(rng.sample(range(sent_len), min(n_anchors, sent_len)))
+    if distinct:
+        verbs = rng.sample(WORDS * (n_anchors // len(WORDS) + 1), len(starts))
+    else:
+        verbs = [rng.choice(SHARED_WORDS) for _ in starts]
+    spans = []
+    for i, (start, verb) in enumerate(zip(starts, verbs)):
+        if distinct:
+            verb = f"{verb}-{i}-"
+        limit = starts[i + 1] if i + 1 < len(starts) else sent_len
+        lemma = verb
+        for end in range(start + 1, min(start + 1 + rng.randint(0, 3), limit) + 1):
+            spans.append((start, end, lemma))
+            lemma = lemma + ' ' + rng.choice(PARTICLES)
+    return spans
+
+def coverage_remove_duplicates(spans):
+    """
+    Reference of the token-coverage rule: a 1-token match is dropped if and only if
+    a longer match covers its token
+    """
+    return [(start, relation) for start, end, relation in spans
+            if end - start > 1 or not any(e - s > 1 and s <= start < e for s, e, _ in spans)]
+
+def legacy_removed(relations):
+    """
+    Replay legacy_remove_duplicates, return (removed, skipped): the indexes of the
+    relations it removed and of those its loop skipped (the one after each removal)
+    """
+    relations = list(enumerate(relations))
+    removed, skipped = set(), set()
+    position = 0
+    while position < len(relations):
+        i, (start, relation1) = relations[position]
+        position += 1
+        if len(relation1.split()) != 1:
+            continue
+        if any(len(relation2.split()) != 1 and relation2.find(relation1) != -1 for _, (_, relation2) in relations):
+            removed.add(i)
+            del relations[position - 1]
+            # list.remove during the for loop: the next relation is never visited
+            if position - 1 < len(relations):
+                skipped.add(relations[position - 1][0])
+                position += 1
+            position -= 1
+    return removed, skipped
+
+def explained(spans, new, legacy):
+    """
+    True if new differs from legacy only in the ways documented for the token-coverage
+    rule: the original also dropped a 1-token relation contained in a longer relation
+    anywhere else in the sentence, and kept a covered one its loop skipped
+    """
+    relations = [(start, lemma) for start, _, lemma in spans]
+    removed, skipped = legacy_removed(relations)
+    kept = set(new)
+    for i, (start, end, lemma) in enumerate(spans):
+        in_new = (start, lemma) in kept
+        in_legacy = i not in removed
+        if in_new == in_legacy:
+            continue
+        if end - start != 1:
+            return False
+        # kept by new, removed by legacy: only because of a longer relation elsewhere
+        if in_new and not any(e - s > 1 and l.find(lemma) != -1 for s, e, l in spans):
+            return False
+        # removed by new, kept by legacy: only because legacy skipped it
+        if in_legacy and i not in skipped:
+            return False
+    return True
+
+def random_ents_rels(rng, sent_len, n_ents, n_rels):
+    ent_list = [(rng.randrange(sent_len), f"ent{i}", "ents") for i in range(n_ents)]
+    relation_list = [(rng.randrange(sent_len), f"rel{i}", "rels") for i in range(n_rels)]
+    return ent_list, relation_list
+
+def check(cases, rng):
+    """
+    Property check, return the number of failures of each of:
+    - 'distinct': dedup on distinct lemmas differs from legacy
+    - 'coverage': dedup on shared lemmas differs from the token-coverage reference
+    - 'unexplained': ... differs from legacy in an undocumented way
+    - 'ordering': order_entity_relation differs from legacy
+    and 'diverged', the number of shared-lemma cases where new and legacy differ
+    """
+    failures = {'distinct': 0, 'coverage': 0, 'unexplained': 0, 'ordering': 0, 'diverged': 0}
+    for _ in range(cases):
+        spans = random_spans(rng, rng.randint(0, 8), rng.randint(1, 40))
+        expected = legacy_remove_duplicates([(start, lemma) for start, _, lemma in spans])
+        if RelationMatcher.remove_duplicates(spans) != expected:
+            failures['distinct'] += 1
+
+        spans = random_spans(rng, rng.randint(0, 8), rng.randint(1, 40), distinct=False)
+        new = RelationMatcher.remove_duplicates(spans)
+        legacy = legacy_remove_duplicates([(start, lemma) for start, _, lemma in spans])
+        if new != coverage_remove_duplicates(spans):
+            failures['coverage'] += 1
+        if new != legacy:
+            failures['diverged'] += 1
+            if not explained(spans, new, legacy):
+                failures['unexplained'] += 1
+
+        ent_list, relation_list = random_ents_rels(rng, 40, rng.randint(0, 8), rng.randint(0, 8))
+        expected = legacy_order_entity_relation(ent_list, relation_list)
+        if Parser.order_entity_relation(ent_list, relation_list) != expected:
+            failures['ordering'] += 1
+    return failures
+
+def timed(func, *args, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--cases", type=int, default=5000)
+    arg_parser.add_argument("--length", type=int, default=2000, help="tokens in the long sentence")
+    args = arg_parser.parse_args()
+    rng = random.Random(0)
+
+    failures = check(args.cases, rng)
+    diverged = failures.pop('diverged')
+    print(f"property check: {args.cases} cases, failures {failures}")
+    print(f"shared lemmas: {diverged} cases differ from legacy, all in the documented ways"
+          if not failures['unexplained'] else f"shared lemmas: {diverged} cases differ from legacy")
+
+    spans = random_spans(rng, args.length // 4, args.length)
+    relations = [(start, lemma) for start, _, lemma in spans]
+    ent_list, relation_list = random_ents_rels(rng, args.length, args.length // 4, args.length // 4)
+    rows = [
+        ("remove_duplicates", timed(lambda: legacy_remove_duplicates(list(relations))),
+            timed(RelationMatcher.remove_duplicates, spans)),
+        ("order_entity_relation", timed(legacy_order_entity_relation, ent_list, relation_list),
+            timed(Parser.order_entity_relation, ent_list, relation_list)),
+    ]
+    print(f"long sentence: {args.length} tokens, {len(spans)} relation matches")
+    print(f"{'function':<24} {'legacy ms':>10} {'new ms':>10} {'speedup':>8}")
+    for name, legacy, new in rows:
+        print(f"{name:<24} {legacy * 1000:>10.2f} {new * 1000:>10.2f} {legacy / new:>7.1f}x")
+    if any(failures.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""
+Time the 4 steps of the app end to end and write the results as json:
+1. build the pipeline (Pipeline(), from scratch and from its cached artifact)
+2. parse the questions of Example_inputs/Qus_ls.txt (Parser.questionParse)
+3. parse Example_inputs/Stock.txt repeated 1x/10x/100x (Parser.docParse, without
+   the parsed-document cache, then answered from it)
+4. search the KG (KnowledgeGraph.find_triples over data.json) and draw it
+   (KGdraw, each printGraph call, and KGgraph for the browser renderer)
+Runs offline (only en_core_web_sm is needed). Compare 2 runs with --compare.
+Usage: python -m benchmarks.suite [--scales 1,10,100] [--repeat N] [--output FILE]
+       python -m benchmarks.suite --compare OLD.json NEW.json [--threshold 1.2]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+DOC_FILE = "Example_inputs/Stock.txt"
+QUS_FILE = "Example_inputs/Qus_ls.txt"
+DB_FILE = "NLPQueryApp/database/data.json"
+SUBTOPIC = "finance"
+RESULTS_DIR = "benchmarks/results"
+
+def measure(func, repeat=1, **sizes):
+    """
+    Call func repeat times.
+    Return its wall and CPU times (seconds) and sizes (anything else worth recording)
+    """
+    wall = []
+    cpu = []
+    for _ in range(repeat):
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        func()
+        wall.append(time.perf_counter() - start_wall)
+        cpu.append(time.process_time() - start_cpu)
+    return {
+        'repeat': repeat,
+        'wall_median': statistics.median(wall),
+        'wall_min': min(wall),
+        'wall_max': max(wall),
+        'cpu_median': statistics.median(cpu),
+        'sizes': sizes,
+    }
+
+def load_questions():
+    with open(QUS_FILE) as f:
+        return [line.strip().strip('"') for line in f if line.strip()]
+
+def bench_pipeline(results, repeat):
+    from QueryParserApp.CustomPipeline import Pipeline
+    results['pipeline.build'] = measure(lambda: Pipeline(use_artifact=False), repeat)
+    Pipeline()  # make sure the artifact exists
+    results['pipeline.load_artifact'] = measure(Pipeline, repeat)
+    return Pipeline()
+
+def bench_questions(results, custom_pipe, questions, repeat):
+    from QueryParserApp.KeywordsParser import Parser
+    parsed = []
+    def parse_all():
+        parsed.clear()
+        for question in questions:
+            parsed.append(Parser(question, custom_pipe).questionParse())
+    def parse_cold():
+        custom_pipe.question_cache.clear()
+        parse_all()
+    results['question.parse'] = measure(parse_cold, repeat, questions=len(questions))
+    results['question.parse_cached'] = measure(parse_all, repeat, questions=len(questions))
+    return parsed
+
+def bench_documents(results, custom_pipe, scales, repeat):
+    from QueryParserApp.KeywordsParser import Parser
+    with open(DOC_FILE) as f:
+        text = f.read()
+    from QueryParserApp.ParseCache import get_doc_cache
+    triples_ls = []
+    for scale in scales:
+        document = "\n".join([text] * scale)
+        # parsing itself: the DocCache would answer every run after the first one
+        def parse():
+            triples_ls[:] = Parser(document, custom_pipe, use_doc_cache=False).docParse()
+        results[f'document.parse_x{scale}'] = measure(parse, max(1, repeat // scale),
+            characters=len(document))
+        results[f'document.parse_x{scale}']['sizes']['triples'] = len(triples_ls)
+        # a document parsed before (the first call stores it in the DocCache, if enabled)
+        def parse_cached():
+            triples_ls[:] = Parser(document, custom_pipe).docParse()
+        parse_cached()
+        results[f'document.parse_cached_x{scale}'] = measure(parse_cached, repeat,
+            characters=len(document), doc_cache=get_doc_cache() is not None)
+    # triples of the 1x document, for the KG steps
+    return Parser(text, custom_pipe, use_doc_cache=False).docParse()
+
+def bench_kg(results, triples_ls, parsed, repeat):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from KnowledgeGraphApp.KGbuild import KnowledgeGraph
+    from KnowledgeGraphApp.TripleStore import TripleStore
+    from KnowledgeGraphApp.CompactStore import CompactStore
+    # questions without entities cannot be drawn (see KnowledgeGraph.KGpanels)
+    queries = [(ents, rels) for ents, rels in parsed if ents]
+    KG = KnowledgeGraph(DB_FILE, SUBTOPIC, triples_ls)
+
+    def load_db():
+        with open(DB_FILE) as f:
+            return CompactStore.from_data(json.load(f), SUBTOPIC)
+    results['kg.load_db'] = measure(load_db, repeat)
+    db_store = load_db()
+    doc_store = TripleStore.from_triples(triples_ls)
+    def find_all():
+        for ents, rels in queries:
+            KG.find_triples(db_store, list(ents), rels)
+            KG.find_triples(doc_store, list(ents), rels)
+    results['kg.find_triples'] = measure(find_all, repeat, queries=len(queries),
+        db_triples=len(db_store), doc_triples=len(doc_store))
+
+    panels = [KG.KGpanels(ents, rels) for ents, rels in queries]
+    def print_all():
+        for query_panels in panels:
+            fig = Figure(figsize=[8, 12], dpi=100)
+            FigureCanvasAgg(fig)
+            for subplot_pos, title, panel_triples in query_panels:
+                KG.printGraph(panel_triples, fig, subplot_pos, title, KG.main_html_str)
+            fig.clear()
+    n_calls = sum(len(query_panels) for query_panels in panels)
+    results['kg.printGraph'] = measure(print_all, repeat, calls=n_calls,
+        triples=sum(len(t) for query_panels in panels for _, _, t in query_panels))
+    results['kg.KGdraw'] = measure(lambda: [KG.KGdraw(ents, rels) for ents, rels in queries],
+        repeat, queries=len(queries))
+    results['kg.KGgraph'] = measure(lambda: [KG.KGgraph(ents, rels) for ents, rels in queries],
+        repeat, queries=len(queries))
+
+def environment():
+    import spacy
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'spacy': spacy.__version__,
+    }
+
+def run(args):
+    scales = [int(scale) for scale in args.scales.split(',')]
+    results = {}
+    custom_pipe = bench_pipeline(results, args.repeat)
+    parsed = bench_questions(results, custom_pipe, load_questions(), args.repeat)
+    triples_ls = bench_documents(results, custom_pipe, scales, args.repeat)
+    bench_kg(results, triples_ls, parsed, args.repeat)
+
+    report = {'environment': environment(), 'pipeline_version': custom_pipe.version, 'results': results}
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, datetime.now().strftime("bench-%Y%m%d-%H%M%S.json"))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"{'benchmark':<26} {'wall s':>10} {'cpu s':>10}")
+    for name, result in results.items():
+        print(f"{name:<26} {result['wall_median']:>10.4f} {result['cpu_median']:>10.4f}")
+    print(f"written to {output}")
+
+def compare(old_file, new_file, threshold):
+    """
+    Print the wall time ratio new/old of every benchmark in both files.
+    Return the names of those slower than threshold times the old run.
+    """
+    with open(old_file) as f:
+        old = json.load(f)['results']
+    with open(new_file) as f:
+        new = json.load(f)['results']
+    regressions = []
+    print(f"{'benchmark':<26} {'old s':>10} {'new s':>10} {'ratio':>7}")
+    for name in new:
+        if name not in old:
+            continue
+        ratio = new[name]['wall_median'] / max(old[name]['wall_median'], 1e-9)
+        flag = ''
+        if ratio > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<26} {old[name]['wall_median']:>10.4f} {new[name]['wall_median']:>10.4f} {ratio:>6.2f}x{flag}")
+    return regressions
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--scales", default="1,10,100", help="copies of Stock.txt to parse")
+    arg_parser.add_argument("--repeat", type=int, default=3,
+        help="runs of each benchmark (docParse at scale N runs repeat // N times, at least once)")
+    arg_parser.add_argument("--output", help=f"json file to write (default: {RESULTS_DIR}/bench-<time>.json)")
+    arg_parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare 2 result files")
+    arg_parser.add_argument("--threshold", type=float, default=1.2,
+        help="with --compare, fail if a benchmark is this many times slower")
+    args = arg_parser.parse_args()
+
+    if args.compare:
+        regressions = compare(*args.compare, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+        return
+    run(args)
+
+if __name__ == '__main__':
+    main()